@@ -1,3 +1,114 @@
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from cart.models import Item, Order
+from movies.models import Movie
+from moviesstore.sessions import SessionStore
+from .views import ORDERS_PAGE_SIZE
 
-# Create your tests here.
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='buyer')
+        self.other = User.objects.create(username='someone-else')
+        self.movies = [
+            Movie.objects.create(name=f'Movie {i}', price=10 + i, description='Sample', image='movie_images/inception.jpg', amount_left=5)
+            for i in range(3)
+        ]
+        self.client.force_login(self.user)
+
+    def create_orders(self, count, user=None):
+        for i in range(count):
+            order = Order.objects.create(user=user or self.user, total=0)
+            for movie in self.movies[:i % 3 + 1]:
+                Item.objects.create(order=order, movie=movie, price=movie.price, quantity=1)
+
+    def walk_pages(self):
+        pages, cursor = [], None
+        while True:
+            data = self.client.get(reverse('accounts.orders'), {'cursor': cursor} if cursor else {}).context['template_data']
+            pages.append([order.id for order in data['orders']])
+            cursor = data['next_cursor']
+            if cursor is None:
+                return pages
+
+    def test_pages_split_at_the_page_size(self):
+        self.create_orders(2 * ORDERS_PAGE_SIZE + 3)
+        self.create_orders(2, user=self.other)
+        pages = self.walk_pages()
+        self.assertEqual([len(page) for page in pages], [ORDERS_PAGE_SIZE, ORDERS_PAGE_SIZE, 3])
+        expected = list(Order.objects.filter(user=self.user).order_by('-date', '-id').values_list('id', flat=True))
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_exact_page_has_no_next_cursor(self):
+        self.create_orders(ORDERS_PAGE_SIZE)
+        self.assertEqual([len(page) for page in self.walk_pages()], [ORDERS_PAGE_SIZE])
+
+    def test_bad_cursor_restarts_from_the_first_page(self):
+        response = self.client.get(reverse('accounts.orders'), {'cursor': 'garbage'})
+        self.assertRedirects(response, reverse('accounts.orders'))
+
+    def test_query_count_does_not_grow_with_orders(self):
+        def queries():
+            with CaptureQueriesContext(connection) as captured:
+                self.client.get(reverse('accounts.orders')).content
+            return len(captured)
+
+        self.create_orders(1)
+        few = queries()
+        self.create_orders(ORDERS_PAGE_SIZE)
+        self.assertEqual(queries(), few)
+
+    def test_export_has_every_order_and_item(self):
+        self.create_orders(4)
+        self.create_orders(1, user=self.other)
+        response = self.client.get(reverse('accounts.orders_export'))
+        orders = response.json()['orders']
+        self.assertEqual([order['id'] for order in orders], list(
+            Order.objects.filter(user=self.user).order_by('-date', '-id').values_list('id', flat=True)
+        ))
+        self.assertEqual(sum(len(order['items']) for order in orders), 1 + 2 + 3 + 1)
+        self.assertEqual(orders[-1]['items'], [[self.movies[0].id, 'Movie 0', 10, 1]])
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="orders.json"')
+
+    def test_export_query_count_does_not_grow_with_orders(self):
+        self.create_orders(1)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('accounts.orders_export'))
+        self.create_orders(20)
+        with self.assertNumQueries(len(few)):
+            self.client.get(reverse('accounts.orders_export'))
+
+class CoalescedSessionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        session = SessionStore()
+        session['_auth_user_id'] = '1'
+        session.save(must_create=True)
+        self.key = session.session_key
+
+    def test_unchanged_save_is_skipped(self):
+        session = SessionStore(self.key)
+        session['_auth_user_id'] = '1'
+        self.assertTrue(session.modified)
+        with CaptureQueriesContext(connection) as queries:
+            session.save()
+        self.assertEqual(len(queries), 0)
+
+    def test_changes_are_persisted(self):
+        session = SessionStore(self.key)
+        session['_auth_user_id'] = '2'
+        session.save()
+        # Read back from the database, not the cache
+        cache.clear()
+        self.assertEqual(SessionStore(self.key).load(), {'_auth_user_id': '2'})
+
+    def test_flush_ends_the_session(self):
+        session = SessionStore(self.key)
+        session.load()
+        session.flush()
+        self.assertFalse(Session.objects.filter(session_key=self.key).exists())
+        self.assertEqual(SessionStore(self.key).load(), {})
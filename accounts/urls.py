@@ -6,4 +6,5 @@ urlpatterns = [
     path('login/', views.login, name='accounts.login'),
     path('logout/', views.logout, name='accounts.logout'),
     path('orders/', views.orders, name='accounts.orders'),
+    path('orders/export/', views.orders_export, name='accounts.orders_export'),
 ]
\ No newline at end of file
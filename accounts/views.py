@@ -4,11 +4,21 @@ from .forms import CustomUserCreationForm, CustomErrorList
 from django.shortcuts import redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
+from django.db.models import Prefetch
+from django.http import JsonResponse
+from cart.cart import CART_COOKIE
+from cart.models import Order, Item
+from movies.utils import date_keyset_page
+
+ORDERS_PAGE_SIZE = 10
 
 @login_required
 def logout(request):
     auth_logout(request)
-    return redirect('home.index')
+    response = redirect('home.index')
+    # The cart cookie outlives the session; don't leave it to whoever uses the browser next
+    response.delete_cookie(CART_COOKIE, samesite='Lax')
+    return response
 
 def login(request):
     template_data = {}
@@ -42,7 +52,30 @@ def signup(request):
 
 @login_required
 def orders(request):
+    order_history = Order.objects.filter(user=request.user).prefetch_related(
+        Prefetch('item_set', queryset=Item.objects.select_related('movie'))
+    )
+    try:
+        orders, next_cursor = date_keyset_page(order_history, request.GET.get('cursor'), ORDERS_PAGE_SIZE)
+    except ValueError:
+        return redirect('accounts.orders')
+
     template_data = {}
     template_data['title'] = 'Orders - Georgia Tech Movie Store'
-    template_data['orders'] = request.user.order_set.all()
-    return render(request, 'accounts/orders.html', {'template_data': template_data})
\ No newline at end of file
+    template_data['orders'] = orders
+    template_data['next_cursor'] = next_cursor
+    return render(request, 'accounts/orders.html', {'template_data': template_data})
+
+@login_required
+def orders_export(request):
+    """Export the full order history as compact JSON: items are [movie_id, movie_name, price, quantity]"""
+    orders = {}
+    for order_id, date, total in Order.objects.filter(user=request.user).order_by('-date', '-id').values_list('id', 'date', 'total'):
+        orders[order_id] = {'id': order_id, 'date': date.isoformat(), 'total': total, 'items': []}
+    items = Item.objects.filter(order__user=request.user).order_by('id').values_list('order_id', 'movie_id', 'movie__name', 'price', 'quantity')
+    for order_id, movie_id, movie_name, price, quantity in items:
+        orders[order_id]['items'].append([movie_id, movie_name, price, quantity])
+
+    response = JsonResponse({'orders': list(orders.values())}, json_dumps_params={'separators': (',', ':')})
+    response['Content-Disposition'] = 'attachment; filename="orders.json"'
+    return response
\ No newline at end of file
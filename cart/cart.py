@@ -0,0 +1,89 @@
+import json
+from django.contrib.auth import SESSION_KEY
+
+CART_COOKIE = 'cart'
+CART_COOKIE_SALT = 'cart.cart'
+CART_COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+
+class Cart:
+    """Shopping cart kept in a signed cookie as integer quantities per movie.
+
+    Prices are never stored in the cookie; the cart page and checkout both price
+    the lines from the Movie rows they load. The cookie also records the user it
+    belongs to: an anonymous cart is taken over at login, while another user's
+    cart, e.g. after a logout on a shared browser, is dropped.
+    """
+
+    def __init__(self, request):
+        self.modified = False
+        self.lines = {}
+        # The logged-in user's id as stored in the session, without loading the User row
+        self.user_id = request.session.get(SESSION_KEY)
+        try:
+            data = json.loads(request.get_signed_cookie(CART_COOKIE, default='{}', salt=CART_COOKIE_SALT))
+            self.lines = {int(movie_id): self.parse_quantity(line) for movie_id, line in data.get('lines', {}).items()}
+            owner = data.get('user')
+        except (ValueError, TypeError, AttributeError):
+            self.lines = {}
+            owner = None
+        if self.lines and owner != self.user_id:
+            if owner is not None:
+                self.lines = {}
+            # Rewrite the cookie for its new owner, or delete another user's cart
+            self.modified = True
+
+    @staticmethod
+    def parse_quantity(line):
+        # Cookies written before prices were dropped hold [quantity, price]
+        quantity = int(line[0] if isinstance(line, list) else line)
+        if quantity <= 0:
+            raise ValueError(quantity)
+        return quantity
+
+    def __len__(self):
+        return len(self.lines)
+
+    @property
+    def movie_ids(self):
+        return list(self.lines)
+
+    @property
+    def quantities(self):
+        """Return {movie_id: quantity} for every line"""
+        return dict(self.lines)
+
+    def quantity(self, movie_id):
+        return self.lines.get(int(movie_id), 0)
+
+    def add(self, movie, quantity):
+        """Set the quantity of a movie, replacing any earlier quantity"""
+        self.lines[movie.id] = quantity
+        self.modified = True
+
+    def remove(self, movie_ids):
+        """Drop the lines of the given movies, e.g. movies that no longer exist"""
+        for movie_id in movie_ids:
+            if self.lines.pop(movie_id, None) is not None:
+                self.modified = True
+
+    def clear(self):
+        self.lines = {}
+        self.modified = True
+
+    def save(self, response):
+        """Write the cart back to its cookie if it changed"""
+        if not self.modified:
+            return response
+        if self.lines:
+            data = {'user': self.user_id, 'lines': {str(movie_id): quantity for movie_id, quantity in self.lines.items()}}
+            response.set_signed_cookie(
+                CART_COOKIE,
+                json.dumps(data, separators=(',', ':')),
+                salt=CART_COOKIE_SALT,
+                max_age=CART_COOKIE_MAX_AGE,
+                httponly=True,
+                samesite='Lax',
+            )
+        else:
+            response.delete_cookie(CART_COOKIE, samesite='Lax')
+        return response
@@ -8,6 +8,12 @@ class Order(models.Model):
     date = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # Supports keyset pagination of a user's order history by (date, id)
+            models.Index(fields=['user', '-date', '-id'], name='cart_order_history_idx'),
+        ]
+
     def __str__(self):
         return str(self.id) + ' - ' + self.user.username
 
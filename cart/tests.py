@@ -1,3 +1,162 @@
+import json
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.signing import get_cookie_signer
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from movies.models import GeographicRegion, Movie, MoviePurchase
+from movies.utils import region_centroids
+from .models import Item, Order
+from .cart import CART_COOKIE, CART_COOKIE_SALT
 
-# Create your tests here.
+class CartTests(TestCase):
+    def setUp(self):
+        self.inception = Movie.objects.create(name='Inception', price=12, description='Dreams', image='movie_images/inception.jpg', amount_left=5)
+        self.memento = Movie.objects.create(name='Memento', price=10, description='Memory', image='movie_images/memento.jpg', amount_left=5)
+
+    def add(self, movie, quantity):
+        return self.client.post(reverse('cart.add', kwargs={'id': movie.id}), {'quantity': quantity})
+
+    def cart_page(self):
+        return self.client.get(reverse('cart.index')).context['template_data']
+
+    def test_add_and_clear(self):
+        self.add(self.inception, 2)
+        self.add(self.memento, 1)
+        self.add(self.memento, 3)
+        template_data = self.cart_page()
+        self.assertEqual(template_data['cart'].quantities, {self.inception.id: 2, self.memento.id: 3})
+        self.assertEqual(template_data['cart_total'], 2 * 12 + 3 * 10)
+        self.client.get(reverse('cart.clear'))
+        self.assertEqual(self.client.cookies[CART_COOKIE].value, '')
+        self.assertEqual(len(self.cart_page()['cart']), 0)
+
+    def test_total_uses_current_prices(self):
+        self.add(self.inception, 2)
+        Movie.objects.filter(id=self.inception.id).update(price=20)
+        self.assertEqual(self.cart_page()['cart_total'], 40)
+
+    def test_deleted_movies_are_dropped(self):
+        self.add(self.inception, 2)
+        self.add(self.memento, 1)
+        self.memento.delete()
+        template_data = self.cart_page()
+        self.assertEqual(template_data['cart_total'], 24)
+        self.assertEqual(template_data['cart'].movie_ids, [self.inception.id])
+        # The pruned cart is written back to the cookie
+        self.assertEqual(self.cart_page()['cart'].movie_ids, [self.inception.id])
+
+    def test_tampered_cookie_is_ignored(self):
+        self.add(self.inception, 2)
+        value = self.client.cookies[CART_COOKIE].value
+        self.client.cookies[CART_COOKIE] = value.replace(':2}', ':9}')
+        self.assertEqual(len(self.cart_page()['cart']), 0)
+        self.client.cookies[CART_COOKIE] = json.dumps({'lines': {str(self.inception.id): 9}})
+        self.assertEqual(len(self.cart_page()['cart']), 0)
+
+    def test_invalid_quantities_are_ignored(self):
+        self.add(self.inception, 'many')
+        self.add(self.memento, 0)
+        self.assertEqual(len(self.cart_page()['cart']), 0)
+        signer = get_cookie_signer(salt=CART_COOKIE + CART_COOKIE_SALT)
+        self.client.cookies[CART_COOKIE] = signer.sign(json.dumps({'lines': {str(self.inception.id): -3}}))
+        self.assertEqual(len(self.cart_page()['cart']), 0)
+
+    def test_anonymous_cart_is_kept_at_login(self):
+        user = User.objects.create_user(username='buyer', password='buyer-password')
+        self.add(self.inception, 2)
+        self.client.post(reverse('accounts.login'), {'username': 'buyer', 'password': 'buyer-password'})
+        self.assertEqual(self.cart_page()['cart'].quantities, {self.inception.id: 2})
+        self.assertEqual(json.loads(self.client.cookies[CART_COOKIE].value.rsplit(':', 2)[0])['user'], str(user.id))
+
+    def test_cart_is_not_shared_between_users(self):
+        first = User.objects.create_user(username='first')
+        second = User.objects.create_user(username='second')
+        self.client.force_login(first)
+        self.add(self.inception, 2)
+        self.client.get(reverse('accounts.logout'))
+        self.assertEqual(self.client.cookies[CART_COOKIE].value, '')
+        # A cookie left behind without going through the logout view still isn't handed over
+        self.client.force_login(first)
+        self.add(self.inception, 2)
+        cookie = self.client.cookies[CART_COOKIE].value
+        self.client.force_login(second)
+        self.client.cookies[CART_COOKIE] = cookie
+        self.assertEqual(len(self.cart_page()['cart']), 0)
+        self.assertEqual(self.client.cookies[CART_COOKIE].value, '')
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='buyer-password')
+        self.client.force_login(self.user)
+        self.inception = Movie.objects.create(name='Inception', price=12, description='Dreams', image='movie_images/inception.jpg', amount_left=5)
+        self.memento = Movie.objects.create(name='Memento', price=10, description='Memory', image='movie_images/memento.jpg', amount_left=5)
+        self.atlanta = GeographicRegion.objects.create(name='Atlanta', latitude=33.749, longitude=-84.388)
+        self.savannah = GeographicRegion.objects.create(name='Savannah', latitude=32.081, longitude=-81.091)
+
+    def add(self, movie, quantity):
+        return self.client.post(reverse('cart.add', kwargs={'id': movie.id}), {'quantity': quantity})
+
+    def purchase(self, latitude=32.1, longitude=-81.1):
+        return self.client.get(reverse('cart.purchase'), {'latitude': latitude, 'longitude': longitude})
+
+    def test_purchases_are_recorded_in_the_nearest_region(self):
+        self.add(self.inception, 2)
+        self.add(self.memento, 1)
+        self.assertEqual(self.purchase().status_code, 200)
+        self.assertEqual(
+            set(MoviePurchase.objects.values_list('movie_id', 'region_id', 'quantity')),
+            {(self.inception.id, self.savannah.id, 2), (self.memento.id, self.savannah.id, 1)},
+        )
+
+    def test_regions_deleted_elsewhere_are_not_used(self):
+        # Another worker deleting a region only bumps the shared version; this cached list goes stale
+        region_centroids()
+        self.savannah.delete()
+        self.add(self.inception, 1)
+        self.assertEqual(self.purchase().status_code, 200)
+        self.assertEqual(list(MoviePurchase.objects.values_list('region_id', flat=True)), [self.atlanta.id])
+
+    def test_short_order_is_rolled_back(self):
+        self.add(self.inception, 2)
+        self.add(self.memento, 6)
+        response = self.purchase()
+        self.assertRedirects(response, reverse('cart.index'), fetch_redirect_response=False)
+        self.assertContains(self.client.get(reverse('cart.index')), 'no longer have enough copies left')
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(Item.objects.exists())
+        self.assertFalse(MoviePurchase.objects.exists())
+        self.assertEqual(list(Movie.objects.order_by('id').values_list('amount_left', flat=True)), [5, 5])
+
+    def test_stock_never_goes_negative(self):
+        self.add(self.inception, 5)
+        self.assertEqual(self.purchase().status_code, 200)
+        self.add(self.inception, 1)
+        self.assertRedirects(self.purchase(), reverse('cart.index'))
+        self.assertEqual(Movie.objects.get(id=self.inception.id).amount_left, 0)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_queries_do_not_grow_with_cart_lines(self):
+        def purchase_queries(movies):
+            for movie in movies:
+                self.add(movie, 1)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.purchase().status_code, 200)
+            return len(queries)
+
+        others = [
+            Movie.objects.create(name=f'Movie {i}', price=5, description='Filler', image='movie_images/inception.jpg', amount_left=5)
+            for i in range(3)
+        ]
+        # Warm the region caches; then both checkouts add counter rows for movies never bought before
+        purchase_queries([self.inception])
+        self.assertEqual(purchase_queries([self.memento]), purchase_queries(others))
+
+    def test_cart_of_deleted_movies_is_not_ordered(self):
+        self.add(self.inception, 1)
+        self.inception.delete()
+        self.assertRedirects(self.purchase(), reverse('cart.index'))
+        self.assertFalse(Order.objects.exists())
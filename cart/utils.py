@@ -1,6 +1,32 @@
-def calculate_cart_total(cart, movies_in_cart):
+from django.db.models import Case, F, PositiveIntegerField, Q, When
+from movies.models import Movie
+
+class InsufficientStock(Exception):
+    """Raised when a checkout asks for more copies than are left"""
+
+def calculate_cart_total(quantities, movies_in_cart):
     total = 0
     for movie in movies_in_cart:
-        quantity = cart[str(movie.id)]
-        total += movie.price * int(quantity)
-    return total
\ No newline at end of file
+        total += movie.price * quantities[movie.id]
+    return total
+
+def decrement_stock(quantities):
+    """Decrement amount_left for {movie_id: quantity} in one conditional UPDATE.
+
+    Raises InsufficientStock unless every movie had enough copies left; run it inside
+    a transaction so the rest of the order rolls back with it.
+    """
+    if not quantities:
+        return
+    enough_left = Q()
+    for movie_id, quantity in quantities.items():
+        enough_left |= Q(id=movie_id, amount_left__gte=quantity)
+    updated = Movie.objects.filter(enough_left).update(
+        amount_left=Case(
+            *[When(id=movie_id, then=F('amount_left') - quantity) for movie_id, quantity in quantities.items()],
+            default=F('amount_left'),
+            output_field=PositiveIntegerField(),
+        )
+    )
+    if updated != len(quantities):
+        raise InsufficientStock()
@@ -1,66 +1,98 @@
 from django.shortcuts import render
 from django.shortcuts import get_object_or_404, redirect
-from movies.models import Movie
-from .utils import calculate_cart_total
+from movies.models import Movie, MoviePurchase
+from movies.page_cache import invalidate_pages
+from movies.trending import record_purchases_in_trends
+from movies.utils import record_purchases_in_rollup, resolve_purchase_region
+from .cart import Cart
+from .utils import calculate_cart_total, decrement_stock, InsufficientStock
 from .models import Order, Item
 from django.contrib.auth.decorators import login_required
+from django.contrib import messages
+from django.db import transaction
 
 def index(request):
-    cart_total = 0
+    cart = Cart(request)
     movies_in_cart = []
-    cart = request.session.get('cart', {})
-    movie_ids = list(cart.keys())
-    if (movie_ids != []):
-        movies_in_cart = Movie.objects.filter(id__in=movie_ids)
-        cart_total = calculate_cart_total(cart, movies_in_cart)
+    if len(cart):
+        movies_in_cart = list(Movie.objects.filter(id__in=cart.movie_ids).only('id', 'name', 'price'))
+        # Forget movies deleted since they were added, so they are neither listed nor charged
+        cart.remove(set(cart.movie_ids) - {movie.id for movie in movies_in_cart})
 
     template_data = {}
     template_data['title'] = 'Cart - Georgia Tech Movie Store'
+    template_data['cart'] = cart
     template_data['movies_in_cart'] = movies_in_cart
-    template_data['cart_total'] = cart_total
-    return render(request, 'cart/index.html', {'template_data': template_data})
+    template_data['cart_total'] = calculate_cart_total(cart.quantities, movies_in_cart)
+    return cart.save(render(request, 'cart/index.html', {'template_data': template_data}))
 
 def add(request, id):
-    get_object_or_404(Movie, id=id)
-    cart = request.session.get('cart', {})
-    cart[id] = request.POST['quantity']
-    request.session['cart'] = cart
-    return redirect('cart.index')
+    movie = get_object_or_404(Movie.objects.only('id', 'price'), id=id)
+    cart = Cart(request)
+    try:
+        quantity = int(request.POST['quantity'])
+    except (KeyError, ValueError):
+        quantity = 0
+    if quantity > 0:
+        cart.add(movie, quantity)
+    return cart.save(redirect('cart.index'))
 
 def clear(request):
-    request.session['cart'] = {}
-    return redirect('cart.index')
+    cart = Cart(request)
+    cart.clear()
+    return cart.save(redirect('cart.index'))
+
+def get_location(request):
+    """Read optional latitude/longitude query parameters sent by the browser"""
+    try:
+        return float(request.GET['latitude']), float(request.GET['longitude'])
+    except (KeyError, ValueError):
+        return None, None
 
 @login_required
 def purchase(request):
-    cart = request.session.get('cart', {})
-    movie_ids = list(cart.keys())
+    cart = Cart(request)
 
-    if (movie_ids == []):
+    if not len(cart):
         return redirect('cart.index')
     
-    movies_in_cart = Movie.objects.filter(id__in=movie_ids)
-    cart_total = calculate_cart_total(cart, movies_in_cart)
+    try:
+        with transaction.atomic():
+            movies_in_cart = list(Movie.objects.filter(id__in=cart.movie_ids))
+            if not movies_in_cart:
+                # Every movie in the cart was deleted; the cart page prunes them
+                return redirect('cart.index')
+            quantities = {movie.id: cart.quantity(movie.id) for movie in movies_in_cart}
+            
+            # Decrement the amount_left of every movie at once, rejecting the order if any is short
+            decrement_stock(quantities)
+            invalidate_pages('movie_list', 'popularity')
+
+            order = Order()
+            order.user = request.user
+            order.total = calculate_cart_total(quantities, movies_in_cart)
+            order.save()
 
-    order = Order()
-    order.user = request.user
-    order.total = cart_total
-    order.save()
+            Item.objects.bulk_create([
+                Item(movie=movie, price=movie.price, order=order, quantity=quantities[movie.id])
+                for movie in movies_in_cart
+            ])
 
-    for movie in movies_in_cart:
-        item = Item()
-        item.movie = movie
-        item.price = movie.price
-        item.order = order
-        item.quantity = cart[str(movie.id)]
-        item.save()
-        
-        # Decrement the amount_left for the movie
-        movie.amount_left -= int(cart[str(movie.id)])
-        movie.save()
+            # Record the purchases for the local popularity map
+            region_id = resolve_purchase_region(request.user, *get_location(request))
+            if region_id is not None:
+                purchases = MoviePurchase.objects.bulk_create([
+                    MoviePurchase(movie=movie, user=request.user, region_id=region_id, quantity=quantities[movie.id])
+                    for movie in movies_in_cart
+                ])
+                record_purchases_in_rollup(purchases)
+                record_purchases_in_trends(purchases)
+    except InsufficientStock:
+        messages.error(request, 'Some movies in your cart no longer have enough copies left.')
+        return redirect('cart.index')
 
-    request.session['cart'] = {}
+    cart.clear()
     template_data = {}
     template_data['title'] = 'Purchase Confirmation - Georgia Tech Movie Store'
     template_data['order_id'] = order.id
-    return render(request, 'cart/purchase.html', {'template_data': template_data})
\ No newline at end of file
+    return cart.save(render(request, 'cart/purchase.html', {'template_data': template_data}))
\ No newline at end of file
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Movie, Review, MoviePetition, PetitionVote, MovieRating, GeographicRegion, MoviePurchase
+from .models import Movie, Review, MoviePetition, PetitionVote, MovieRating, GeographicRegion, MoviePurchase, RegionMoviePopularity, RegionMovieTrend
 
 class MovieAdmin(admin.ModelAdmin):
     ordering = ['name']
@@ -19,6 +19,7 @@ class MoviePetitionAdmin(admin.ModelAdmin):
     search_fields = ['movie_name', 'description', 'created_by__username']
     readonly_fields = ['created_at']
     list_editable = ['is_approved']
+    list_select_related = ['created_by']
     inlines = [PetitionVoteInline]
     
     def vote_count(self, obj):
@@ -51,10 +52,24 @@ class MoviePurchaseAdmin(admin.ModelAdmin):
     search_fields = ['user__username', 'movie__name', 'region__name']
     readonly_fields = ['purchase_date']
 
+class RegionMoviePopularityAdmin(admin.ModelAdmin):
+    list_display = ['region', 'movie', 'total_quantity', 'last_purchased_at']
+    list_filter = ['region']
+    search_fields = ['movie__name', 'region__name']
+    readonly_fields = ['region', 'movie', 'total_quantity', 'last_purchased_at']
+
+class RegionMovieTrendAdmin(admin.ModelAdmin):
+    list_display = ['region', 'movie', 'granularity', 'bucket', 'quantity']
+    list_filter = ['granularity', 'region']
+    search_fields = ['movie__name', 'region__name']
+    readonly_fields = ['region', 'movie', 'granularity', 'bucket', 'quantity']
+
 admin.site.register(Movie, MovieAdmin)
 admin.site.register(Review)
 admin.site.register(MoviePetition, MoviePetitionAdmin)
 admin.site.register(PetitionVote, PetitionVoteAdmin)
 admin.site.register(MovieRating, MovieRatingAdmin)
 admin.site.register(GeographicRegion, GeographicRegionAdmin)
-admin.site.register(MoviePurchase, MoviePurchaseAdmin)
\ No newline at end of file
+admin.site.register(MoviePurchase, MoviePurchaseAdmin)
+admin.site.register(RegionMoviePopularity, RegionMoviePopularityAdmin)
+admin.site.register(RegionMovieTrend, RegionMovieTrendAdmin)
\ No newline at end of file
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class MoviesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'movies'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from moviesstore.db import apply_sqlite_pragmas
+        from . import signals  # noqa: F401
+        connection_created.connect(apply_sqlite_pragmas)
@@ -0,0 +1,82 @@
+import csv
+import json
+from datetime import datetime, time, timedelta
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from cart.models import Item, Order
+from .models import MoviePurchase, MovieRating
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# name: (model, date field, region field or None, exported columns)
+EXPORT_TABLES = {
+    'purchases': (MoviePurchase, 'purchase_date', 'region', ['id', 'user_id', 'movie_id', 'region_id', 'quantity', 'purchase_date']),
+    'ratings': (MovieRating, 'rated_at', None, ['id', 'user_id', 'movie_id', 'rating', 'rated_at']),
+    'orders': (Order, 'date', None, ['id', 'user_id', 'total', 'date']),
+    'items': (Item, 'order__date', None, ['id', 'order_id', 'movie_id', 'price', 'quantity', 'order__date']),
+}
+
+class Echo:
+    """File-like object whose write() hands the line back, so csv.writer can feed a generator"""
+
+    def write(self, value):
+        return value
+
+def parse_bound(value, end=False):
+    """Parse a start/end filter given as an ISO date or datetime; a date end covers the whole day"""
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'Invalid date: {value!r}')
+        moment = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    elif end:
+        moment += timedelta(microseconds=1)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+def export_rows(table, start=None, end=None, region=None):
+    """Return (columns, row iterator) for an export table, raising ValueError for bad filters"""
+    if table not in EXPORT_TABLES:
+        raise ValueError(f'Unknown table {table!r}, choose from {", ".join(EXPORT_TABLES)}')
+    model, date_field, region_field, columns = EXPORT_TABLES[table]
+    queryset = model.objects.all()
+    start, end = parse_bound(start), parse_bound(end, end=True)
+    if start:
+        queryset = queryset.filter(**{f'{date_field}__gte': start})
+    if end:
+        queryset = queryset.filter(**{f'{date_field}__lt': end})
+    if region:
+        if region_field is None:
+            raise ValueError(f'{table} cannot be filtered by region')
+        queryset = queryset.filter(**{f'{region_field}_id': int(region)})
+    return columns, queryset.order_by('id').values_list(*columns).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+def export_lines(columns, rows, format):
+    """Yield the export one line at a time as CSV or JSON Lines"""
+    if format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(columns)
+        for row in rows:
+            yield writer.writerow([value.isoformat() if isinstance(value, datetime) else value for value in row])
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(columns, row)), default=lambda value: value.isoformat()) + '\n'
+
+async def aexport_lines(lines):
+    """Async iterator over export lines for ASGI servers.
+
+    Django buffers a sync iterator completely before sending it over ASGI, so the
+    lines are pulled EXPORT_CHUNK_SIZE at a time in the request's database thread
+    and sent as they come, keeping memory flat.
+    """
+    lines = iter(lines)
+    next_chunk = sync_to_async(lambda: list(islice(lines, EXPORT_CHUNK_SIZE)))
+    while chunk := await next_chunk():
+        yield ''.join(chunk)
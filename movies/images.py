@@ -0,0 +1,103 @@
+import hashlib
+import os
+from io import BytesIO
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+# Poster widths in pixels; the catalog shows posters about 140px wide and the detail page about 280px,
+# so these cover both at 1x and 2x pixel density
+POSTER_WIDTHS = (160, 320, 640)
+POSTER_FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+VARIANTS_DIR = 'variants'
+VARIANTS_CACHE_KEY = 'movies:poster_variants:{}'
+# Originals that could not be resized are retried after this long
+VARIANT_RETRY_SECONDS = 300
+
+def variants_cache_key(name):
+    return VARIANTS_CACHE_KEY.format(hashlib.md5(name.encode()).hexdigest())
+
+def variant_name(name, width, image_format):
+    """Storage name of one resized copy: movie_images/inception.jpg -> movie_images/variants/inception-jpg-320w.webp
+
+    The original extension stays in the name so inception.jpg and inception.png never share variants.
+    """
+    directory, filename = os.path.split(name)
+    stem, original_extension = os.path.splitext(filename)
+    extension = 'jpg' if image_format == 'jpeg' else image_format
+    source = f'-{original_extension[1:].lower()}' if original_extension else ''
+    return os.path.join(directory, VARIANTS_DIR, f'{stem}{source}-{width}w.{extension}')
+
+def generate_variants(storage, name, force=False):
+    """Write every width and format of a poster that is missing (or all of them with force) and return how many were written"""
+    targets = [
+        (width, image_format, variant_name(name, width, image_format))
+        for width in POSTER_WIDTHS
+        for image_format in POSTER_FORMATS
+    ]
+    if not force:
+        targets = [target for target in targets if not storage.exists(target[2])]
+    if not targets:
+        return 0
+
+    with storage.open(name) as original:
+        image = ImageOps.exif_transpose(Image.open(original))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    for width, image_format, target in targets:
+        # Never upscale: narrow originals just get re-encoded at their own size
+        resized = image.copy()
+        resized.thumbnail((width, width * 4), Image.LANCZOS)
+        if image_format == 'jpeg' and resized.mode == 'RGBA':
+            resized = resized.convert('RGB')
+        buffer = BytesIO()
+        resized.save(buffer, **POSTER_FORMATS[image_format])
+        if storage.exists(target):
+            storage.delete(target)
+        storage.save(target, ContentFile(buffer.getvalue()))
+    return len(targets)
+
+def ensure_variants(image):
+    """Make sure an ImageField file has its variants, generating them on first use; False if it cannot be resized"""
+    key = variants_cache_key(image.name)
+    ready = cache.get(key)
+    if ready is None:
+        try:
+            generate_variants(image.storage, image.name)
+            ready = True
+        except (OSError, ValueError):
+            # Missing or unreadable originals are served as they are until the next retry
+            ready = False
+        cache.set(key, ready, None if ready else VARIANT_RETRY_SECONDS)
+    return ready
+
+def variant_url(image, width, image_format):
+    return image.storage.url(variant_name(image.name, width, image_format))
+
+def variant_srcset(image, image_format):
+    return ', '.join(f'{variant_url(image, width, image_format)} {width}w' for width in POSTER_WIDTHS)
+
+def poster_url(image, width, image_format='jpeg'):
+    if not image or not ensure_variants(image):
+        return image.url if image else ''
+    return variant_url(image, width, image_format)
+
+def poster_srcset(image, image_format='jpeg'):
+    """A srcset listing every width of a poster, or an empty string when only the original is available"""
+    if not image or not ensure_variants(image):
+        return ''
+    return variant_srcset(image, image_format)
+
+def poster_sources(image, width):
+    """Everything a <picture> needs: {'src': JPEG URL at width, 'jpeg': srcset, 'webp': srcset}.
+
+    Checks the variants once, where separate poster_url and poster_srcset calls check them once each.
+    """
+    if not image or not ensure_variants(image):
+        return {'src': image.url if image else '', 'jpeg': '', 'webp': ''}
+    return {'src': variant_url(image, width, 'jpeg'), **{image_format: variant_srcset(image, image_format) for image_format in POSTER_FORMATS}}
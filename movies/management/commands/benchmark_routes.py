@@ -0,0 +1,334 @@
+from collections import namedtuple
+from io import StringIO
+from itertools import count
+from pathlib import Path
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import URLResolver, get_resolver, reverse
+from cart.models import Item, Order
+from movies.models import GeographicRegion, Movie, MoviePetition, Review
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'
+DEFAULT_RESULTS = Path(settings.BASE_DIR) / 'benchmarks' / 'results.json'
+PASSWORD = 'benchmark-password'
+MEMORY_SAMPLES = 3
+# Latency and peak memory differences below these are treated as noise whatever the tolerance
+MIN_LATENCY_DELTA_MS = 1.0
+MIN_MEMORY_DELTA_KIB = 32
+# Latencies are stored as multiples of this route's p50, measured in the same run,
+# so a baseline recorded on one machine still holds on a faster or slower one
+REFERENCE_ROUTE = 'home.about'
+
+ANONYMOUS, CUSTOMER, STAFF = 'anonymous', 'customer', 'staff'
+
+# user: who the client is logged in as; prepare(fixtures, client) -> (method, url kwargs, data),
+# called before every request and kept out of the timings
+Route = namedtuple('Route', ['user', 'prepare'])
+
+def get(query=None, **kwargs):
+    return lambda f, client: ('get', {name: value(f) for name, value in kwargs.items()}, query or {})
+
+def url_name(route):
+    """The URL name of a benchmark entry; variants of a route are named <url name>:<variant>"""
+    return route.split(':')[0]
+
+def prepare_login(f, client):
+    client.logout()
+    return 'post', {}, {'username': f.customer.username, 'password': PASSWORD}
+
+def prepare_logout(f, client):
+    client.force_login(f.customer)
+    return 'get', {}, {}
+
+def prepare_signup(f, client):
+    username = f'bench-signup-{f.unique()}'
+    return 'post', {}, {'username': username, 'password1': PASSWORD, 'password2': PASSWORD}
+
+def prepare_purchase(f, client):
+    client.post(reverse('cart.add', kwargs={'id': f.movie.id}), {'quantity': 2})
+    return 'get', {}, {'latitude': f.region.latitude, 'longitude': f.region.longitude}
+
+# Every named route of the project, plus variants that take a different code path;
+# logged-in users bypass the anonymous page cache, so the catalog pages measure the views themselves
+ROUTES = {
+    'home.index': Route(ANONYMOUS, get()),
+    'home.about': Route(ANONYMOUS, get()),
+    'movies.index': Route(CUSTOMER, get()),
+    'movies.show': Route(CUSTOMER, get(id=lambda f: f.movie.id)),
+    'movies.create_review': Route(CUSTOMER, lambda f, client: (
+        'post', {'id': f.movie.id}, {'comment': f'Benchmark review {f.unique()}'},
+    )),
+    'movies.edit_review': Route(CUSTOMER, get(id=lambda f: f.movie.id, review_id=lambda f: f.review.id)),
+    'movies.delete_review': Route(CUSTOMER, lambda f, client: (
+        'post', {'id': f.movie.id, 'review_id': f.new_review().id}, {},
+    )),
+    'movies.review_page_api': Route(ANONYMOUS, get(id=lambda f: f.movie.id)),
+    'movies.rate_movie': Route(CUSTOMER, lambda f, client: (
+        'post', {'movie_id': f.movie.id}, {'rating': f.unique() % 5 + 1},
+    )),
+    'movies.petition_list': Route(CUSTOMER, get()),
+    'movies.create_petition': Route(CUSTOMER, lambda f, client: (
+        'post', {}, {'movie_name': f'Benchmark petition {f.unique()}', 'description': 'Please stock it'},
+    )),
+    'movies.petition_detail': Route(CUSTOMER, get(petition_id=lambda f: f.petition.id)),
+    'movies.vote_petition': Route(CUSTOMER, lambda f, client: (
+        'post', {'petition_id': f.petition.id}, {'vote_type': 'yes' if f.unique() % 2 else 'no'},
+    )),
+    'movies.local_popularity_map': Route(CUSTOMER, get()),
+    'movies.local_popularity_map:7d': Route(CUSTOMER, get({'window': '7d'})),
+    'movies.local_popularity_map:trending': Route(CUSTOMER, get({'window': 'trending'})),
+    'movies.region_detail': Route(CUSTOMER, get(region_id=lambda f: f.region.id)),
+    'movies.region_detail:trending': Route(CUSTOMER, get({'window': 'trending'}, region_id=lambda f: f.region.id)),
+    'movies.region_data_api': Route(ANONYMOUS, get(region_id=lambda f: f.region.id)),
+    'movies.regions_data_api': Route(ANONYMOUS, get()),
+    'movies.regions_data_api:bbox': Route(ANONYMOUS, get({'bbox': '33.7,-84.5,33.9,-84.3', 'limit': 10})),
+    'movies.export_data': Route(STAFF, get(table=lambda f: 'ratings')),
+    'cart.index': Route(CUSTOMER, get()),
+    'cart.add': Route(CUSTOMER, lambda f, client: ('post', {'id': f.movie.id}, {'quantity': 1})),
+    'cart.clear': Route(CUSTOMER, get()),
+    'cart.purchase': Route(CUSTOMER, prepare_purchase),
+    'accounts.signup': Route(ANONYMOUS, prepare_signup),
+    'accounts.login': Route(ANONYMOUS, prepare_login),
+    'accounts.logout': Route(CUSTOMER, prepare_logout),
+    'accounts.orders': Route(CUSTOMER, get()),
+    'accounts.orders_export': Route(CUSTOMER, get()),
+    'metrics': Route(STAFF, get()),
+}
+
+# Views behind movies.page_cache; --cached times them as anonymous hits on a warm cache
+CACHED_ROUTES = ['movies.index', 'movies.show', 'movies.petition_list', 'movies.local_popularity_map']
+
+def named_routes(patterns=None):
+    """Names of every route in the project's URL configuration, leaving out namespaced apps such as the admin"""
+    names = set()
+    for pattern in get_resolver().url_patterns if patterns is None else patterns:
+        if isinstance(pattern, URLResolver):
+            if not pattern.namespace:
+                names |= named_routes(pattern.url_patterns)
+        elif pattern.name:
+            names.add(pattern.name)
+    return names
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+class Fixtures:
+    """The busiest objects of the generated dataset plus a customer and a staff member"""
+
+    def __init__(self):
+        self.counter = count()
+        self.customer = User.objects.create_user(username='bench-customer', password=PASSWORD)
+        self.staff = User.objects.create_user(username='bench-staff', password=PASSWORD, is_staff=True)
+        self.movie = Movie.objects.annotate(review_count=Count('review')).order_by('-review_count', 'id').first()
+        Movie.objects.filter(id=self.movie.id).update(amount_left=10 ** 6)
+        self.region = GeographicRegion.objects.annotate(purchase_count=Count('purchases')).order_by('-purchase_count', 'id').first()
+        self.petition = MoviePetition.objects.order_by('-yes_votes', 'id').first() or MoviePetition.objects.create(
+            movie_name='Benchmark petition', description='Please stock it', created_by=self.customer,
+        )
+        self.review = self.new_review()
+        for _ in range(25):
+            order = Order.objects.create(user=self.customer, total=self.movie.price)
+            Item.objects.create(order=order, movie=self.movie, price=self.movie.price, quantity=1)
+
+    def unique(self):
+        return next(self.counter)
+
+    def new_review(self):
+        return Review.objects.create(movie=self.movie, user=self.customer, comment='Benchmark review')
+
+class Command(BaseCommand):
+    help = 'Benchmark every named route on a generated dataset and compare the results with a stored baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--routes', nargs='+', choices=sorted(ROUTES), default=sorted(ROUTES))
+        parser.add_argument('--cached', action='store_true', help='Also time anonymous page cache hits, reported as <route>:cached')
+        parser.add_argument('--iterations', type=int, default=30, help='Timed requests per route')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per route')
+        parser.add_argument('--movies', type=int, default=500)
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--purchases', type=int, default=20000)
+        parser.add_argument('--ratings', type=int, default=10000)
+        parser.add_argument('--reviews', type=int, default=5000)
+        parser.add_argument('--petitions', type=int, default=100)
+        parser.add_argument('--votes', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', default=str(DEFAULT_RESULTS), help='Where to write the results')
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help='Results to compare against')
+        parser.add_argument('--update-baseline', action='store_true', help='Store these results as the new baseline')
+        parser.add_argument('--latency-tolerance', type=float, default=0.5, help='Allowed relative p50 slowdown; p90 is only reported')
+        parser.add_argument('--memory-tolerance', type=float, default=0.25, help='Allowed relative peak memory growth')
+
+    def handle(self, *args, **options):
+        missing = named_routes() - {url_name(route) for route in ROUTES}
+        if missing:
+            raise CommandError(f'No benchmark defined for: {", ".join(sorted(missing))}')
+
+        dataset = {name: options[name] for name in ['movies', 'users', 'purchases', 'ratings', 'reviews', 'petitions', 'votes', 'seed']}
+        # Run against a throwaway test database so the benchmark never touches real data
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            call_command('populate_sample_data', stdout=StringIO(), **dataset)
+            fixtures = Fixtures()
+            routes = {}
+            self.stdout.write(f"{'route':<36}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'queries':>9}{'peak KiB':>10}")
+            for name in options['routes']:
+                routes[name] = self.measure(name, ROUTES[name], fixtures, options['iterations'], options['warmup'])
+                self.report(name, routes[name])
+            if options['cached']:
+                for name in CACHED_ROUTES:
+                    route = ROUTES[name]._replace(user=ANONYMOUS)
+                    routes[f'{name}:cached'] = self.measure(name, route, fixtures, options['iterations'], options['warmup'])
+                    self.report(f'{name}:cached', routes[f'{name}:cached'])
+            reference = routes.get(REFERENCE_ROUTE) or self.measure(
+                REFERENCE_ROUTE, ROUTES[REFERENCE_ROUTE], fixtures, options['iterations'], options['warmup'],
+            )
+            reference_ms = reference['p50_ms']
+            self.stdout.write(f'Reference {REFERENCE_ROUTE} p50: {reference_ms:.2f} ms')
+            for result in routes.values():
+                self.relative(result, reference_ms)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        results = {
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+            },
+            'dataset': dataset,
+            'iterations': options['iterations'],
+            'reference_route': REFERENCE_ROUTE,
+            'reference_ms': reference_ms,
+            'routes': routes,
+        }
+        self.write_json(options['output'], results)
+        if options['update_baseline']:
+            self.write_json(options['baseline'], results)
+            return
+
+        baseline_path = Path(options['baseline'])
+        if not baseline_path.exists():
+            self.stdout.write(f'No baseline at {baseline_path}; run with --update-baseline to store one')
+            return
+        regressions = self.compare(json.loads(baseline_path.read_text()), results, options)
+        if regressions:
+            for regression in regressions:
+                self.stderr.write(regression)
+            raise CommandError(f'{len(regressions)} regression(s) against {baseline_path}')
+        self.stdout.write(self.style.SUCCESS(f'No regressions against {baseline_path}'))
+
+    def relative(self, result, reference_ms):
+        """Add the p50/p90 latencies as multiples of the reference route's p50"""
+        for key in ['p50', 'p90']:
+            result[f'{key}_relative'] = round(result[f'{key}_ms'] / reference_ms, 3)
+
+    def report(self, name, result):
+        self.stdout.write(
+            f"{name:<36}{result['p50_ms']:>9.2f}{result['p90_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+            f"{result['queries']:>9}{result['peak_kib']:>10.0f}"
+        )
+
+    def measure(self, name, route, fixtures, iterations, warmup):
+        client = Client()
+        if route.user == CUSTOMER:
+            client.force_login(fixtures.customer)
+        elif route.user == STAFF:
+            client.force_login(fixtures.staff)
+
+        timings, query_counts = [], []
+        for i in range(warmup + iterations):
+            with CaptureQueriesContext(connection) as queries:
+                elapsed = self.request(name, route, fixtures, client)
+            if i >= warmup:
+                timings.append(elapsed * 1000)
+                query_counts.append(len(queries))
+
+        # Memory is sampled separately because tracing allocations slows every request down
+        peak = 0
+        tracemalloc.start()
+        try:
+            for _ in range(MEMORY_SAMPLES):
+                self.request(name, route, fixtures, client, before=tracemalloc.reset_peak)
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'p50_ms': round(percentile(timings, 0.5), 3),
+            'p90_ms': round(percentile(timings, 0.9), 3),
+            'p99_ms': round(percentile(timings, 0.99), 3),
+            'mean_ms': round(statistics.fmean(timings), 3),
+            'queries': max(query_counts),
+            'peak_kib': round(peak / 1024, 1),
+        }
+
+    def request(self, name, route, fixtures, client, before=None):
+        method, kwargs, data = route.prepare(fixtures, client)
+        url = reverse(url_name(name), kwargs=kwargs)
+        if before:
+            before()
+        start = time.perf_counter()
+        response = getattr(client, method)(url, data)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        elapsed = time.perf_counter() - start
+        if response.status_code >= 400:
+            raise CommandError(f'{name} answered {response.status_code}')
+        return elapsed
+
+    def compare(self, baseline, results, options):
+        """Check query counts, relative p50 latencies and memory; a route missing from the baseline is a failure.
+
+        p90 over a few dozen samples swings too much to fail on, so its drift is only reported.
+        The budgets are scaled by the median speed of all routes against the baseline rather than
+        by the reference route alone, so one noisy reference measurement cannot move every budget.
+        """
+        regressions = []
+        speeds = [
+            result['p50_ms'] / baseline['routes'][name]['p50_relative']
+            for name, result in results['routes'].items()
+            if baseline['routes'].get(name, {}).get('p50_relative')
+        ]
+        reference_ms = statistics.median(speeds) if speeds else results['reference_ms']
+        self.stdout.write(f"{REFERENCE_ROUTE} p50 implied by all routes: {reference_ms:.2f} ms, measured {results['reference_ms']:.2f} ms")
+        for name, result in results['routes'].items():
+            expected = baseline['routes'].get(name)
+            if expected is None:
+                regressions.append(f'{name}: not in the baseline, run with --update-baseline to add it')
+                continue
+            if result['queries'] > expected['queries']:
+                regressions.append(f"{name}: {result['queries']} queries, baseline {expected['queries']}")
+            for key in ['p50', 'p90']:
+                # The budget is relative to this machine's reference route
+                budget_ms = expected[f'{key}_relative'] * reference_ms
+                allowed = max(budget_ms * (1 + options['latency_tolerance']), budget_ms + MIN_LATENCY_DELTA_MS)
+                if result[f'{key}_ms'] > allowed:
+                    message = f"{name}: {key} {result[f'{key}_relative']:.2f}x the reference route, baseline {expected[f'{key}_relative']:.2f}x"
+                    if key == 'p50':
+                        regressions.append(message)
+                    else:
+                        self.stdout.write(f'{message} (not a failure)')
+            if result['peak_kib'] > max(expected['peak_kib'] * (1 + options['memory_tolerance']), expected['peak_kib'] + MIN_MEMORY_DELTA_KIB):
+                regressions.append(f"{name}: peak {result['peak_kib']:.0f} KiB, baseline {expected['peak_kib']:.0f} KiB")
+        return regressions
+
+    def write_json(self, path, results):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(results, indent=2) + '\n')
+        self.stdout.write(f'Wrote {path}')
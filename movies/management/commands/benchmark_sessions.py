@@ -0,0 +1,53 @@
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from movies.models import Movie
+
+class Command(BaseCommand):
+    help = 'Measure requests per second on the cart and movie pages for every session mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per page and mode')
+        parser.add_argument('--modes', nargs='+', choices=sorted(settings.SESSION_ENGINES), default=sorted(settings.SESSION_ENGINES))
+
+    def handle(self, *args, **options):
+        # Run against a throwaway test database so the benchmark never touches real sessions
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            user = User.objects.create_user(username='benchmark', password='benchmark')
+            movie = Movie.objects.create(name='Benchmark', price=10, description='Benchmark movie', image='movie_images/inception.jpg', amount_left=10)
+            pages = {
+                'cart': reverse('cart.index'),
+                'movie': reverse('movies.show', kwargs={'id': movie.id}),
+            }
+
+            self.stdout.write(f"{'mode':<16}{'page':<8}{'req/s':>10}{'session writes':>16}")
+            for mode in options['modes']:
+                with override_settings(SESSION_ENGINE=settings.SESSION_ENGINES[mode]):
+                    client = Client()
+                    client.force_login(user)
+                    client.post(reverse('cart.add', kwargs={'id': movie.id}), {'quantity': 1})
+                    for page, url in pages.items():
+                        rate, writes = self.measure(client, url, options['requests'])
+                        self.stdout.write(f'{mode:<16}{page:<8}{rate:>10.0f}{writes:>16}')
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def measure(self, client, url, requests):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(requests):
+                client.get(url)
+            elapsed = time.perf_counter() - start
+        writes = sum(
+            1 for query in queries
+            if 'django_session' in query['sql'] and query['sql'].lstrip().startswith(('INSERT', 'UPDATE'))
+        )
+        return requests / elapsed, writes
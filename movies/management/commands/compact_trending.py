@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from movies.trending import compact_trends, rebuild_trends
+
+class Command(BaseCommand):
+    help = 'Roll old hourly trend buckets up into daily buckets and drop expired ones; run it hourly'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Recount every trend bucket from MoviePurchase instead')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            with transaction.atomic():
+                created = rebuild_trends()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {created} trend buckets'))
+            return
+
+        rolled, expired = compact_trends()
+        self.stdout.write(
+            self.style.SUCCESS(f'Rolled {rolled} hourly buckets into days and dropped {expired} expired daily buckets')
+        )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from movies.exports import EXPORT_FORMATS, EXPORT_TABLES, export_lines, export_rows
+
+class Command(BaseCommand):
+    help = 'Stream purchase, rating, order or item history as CSV or JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', choices=sorted(EXPORT_TABLES))
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--start', help='Only rows on or after this ISO date/datetime')
+        parser.add_argument('--end', help='Only rows on or before this ISO date/datetime')
+        parser.add_argument('--region', type=int, help='Only rows for this GeographicRegion id (purchases)')
+        parser.add_argument('--output', help='File to write instead of stdout')
+
+    def handle(self, *args, **options):
+        try:
+            columns, rows = export_rows(options['table'], options['start'], options['end'], options['region'])
+        except ValueError as error:
+            raise CommandError(error)
+        
+        lines = export_lines(columns, rows, options['format'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
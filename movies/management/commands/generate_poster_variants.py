@@ -0,0 +1,39 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import time
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from movies.images import generate_variants, variants_cache_key
+from movies.models import Movie
+
+def generate(name, force):
+    # Runs in a worker process, so it looks the storage up there instead of pickling it
+    return generate_variants(Movie._meta.get_field('image').storage, name, force)
+
+class Command(BaseCommand):
+    help = 'Generate the resized JPEG and WebP variants of every movie poster'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes')
+        parser.add_argument('--force', action='store_true', help='Regenerate variants that already exist')
+
+    def handle(self, *args, **options):
+        names = sorted(set(Movie.objects.exclude(image='').values_list('image', flat=True)))
+        start = time.perf_counter()
+        written = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as executor:
+            futures = {executor.submit(generate, name, options['force']): name for name in names}
+            for future in as_completed(futures):
+                try:
+                    written += future.result()
+                except (OSError, ValueError) as error:
+                    failed += 1
+                    self.stderr.write(f'{futures[future]}: {error}')
+
+        # With a shared cache, web processes re-check posters they had given up on
+        cache.delete_many([variants_cache_key(name) for name in names])
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {written} variants for {len(names) - failed} posters in {time.perf_counter() - start:.1f}s'
+            + (f', {failed} failed' if failed else '')
+        ))
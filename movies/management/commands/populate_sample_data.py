@@ -1,85 +1,185 @@
-from django.core.management.base import BaseCommand
-from django.contrib.auth.models import User
-from movies.models import GeographicRegion, Movie, MoviePurchase, MovieRating
+from datetime import timedelta
 import random
+import time
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from movies.models import GeographicRegion, Movie, MoviePetition, MoviePurchase, MovieRating, PetitionVote, Review
+from movies.page_cache import invalidate_all_pages
+from movies.search import rebuild_search_index
+from movies.trending import rebuild_trends
+from movies.utils import forget_region_centroids, petition_vote_tallies, rebuild_rating_aggregates, rebuild_region_popularity
+
+# Sample regions around Georgia Tech, created first; any extra regions are scattered around them
+REGIONS_DATA = [
+    {'name': 'Atlanta Downtown', 'lat': 33.7490, 'lng': -84.3880, 'zoom': 12},
+    {'name': 'Midtown Atlanta', 'lat': 33.7849, 'lng': -84.3843, 'zoom': 13},
+    {'name': 'Buckhead', 'lat': 33.8470, 'lng': -84.3659, 'zoom': 13},
+    {'name': 'Decatur', 'lat': 33.7748, 'lng': -84.2963, 'zoom': 12},
+    {'name': 'Sandy Springs', 'lat': 33.9304, 'lng': -84.3733, 'zoom': 12},
+    {'name': 'Alpharetta', 'lat': 34.0754, 'lng': -84.2941, 'zoom': 11},
+    {'name': 'Marietta', 'lat': 33.9526, 'lng': -84.5499, 'zoom': 12},
+    {'name': 'Roswell', 'lat': 34.0232, 'lng': -84.3615, 'zoom': 12},
+]
+POSTERS = ['movie_images/avatar.jpg', 'movie_images/inception.jpg', 'movie_images/titanic.jpg']
+WORDS = [
+    'dream', 'heist', 'ocean', 'galaxy', 'love', 'war', 'detective', 'storm', 'city', 'robot',
+    'island', 'secret', 'journey', 'winter', 'shadow', 'empire', 'river', 'music', 'ghost', 'family',
+]
+PROGRESS_INTERVAL = 1.0
 
 class Command(BaseCommand):
-    help = 'Populate sample geographic regions and purchase data'
+    help = 'Populate sample regions, users, movies, purchases, ratings, reviews, petitions and votes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--regions', type=int, default=len(REGIONS_DATA), help='Total regions to have')
+        parser.add_argument('--movies', type=int, default=0, help='Movies to generate')
+        parser.add_argument('--users', type=int, default=0, help='Users to generate')
+        parser.add_argument('--purchases', type=int, default=50, help='Purchases to generate')
+        parser.add_argument('--ratings', type=int, default=30, help='Ratings to attempt; duplicate (movie, user) pairs are skipped')
+        parser.add_argument('--reviews', type=int, default=0, help='Reviews to generate')
+        parser.add_argument('--petitions', type=int, default=0, help='Petitions to generate')
+        parser.add_argument('--votes', type=int, default=0, help='Votes to attempt; duplicate (petition, user) pairs are skipped')
+        parser.add_argument('--days', type=int, default=0, help='Spread purchase, rating and review dates over this many past days')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible data')
+        parser.add_argument('--batch-size', type=int, default=5000)
 
     def handle(self, *args, **options):
-        # Create sample geographic regions around Georgia Tech
-        regions_data = [
-            {'name': 'Atlanta Downtown', 'lat': 33.7490, 'lng': -84.3880, 'zoom': 12},
-            {'name': 'Midtown Atlanta', 'lat': 33.7849, 'lng': -84.3843, 'zoom': 13},
-            {'name': 'Buckhead', 'lat': 33.8470, 'lng': -84.3659, 'zoom': 13},
-            {'name': 'Decatur', 'lat': 33.7748, 'lng': -84.2963, 'zoom': 12},
-            {'name': 'Sandy Springs', 'lat': 33.9304, 'lng': -84.3733, 'zoom': 12},
-            {'name': 'Alpharetta', 'lat': 34.0754, 'lng': -84.2941, 'zoom': 11},
-            {'name': 'Marietta', 'lat': 33.9526, 'lng': -84.5499, 'zoom': 12},
-            {'name': 'Roswell', 'lat': 34.0232, 'lng': -84.3615, 'zoom': 12},
-        ]
-        
-        # Create regions
-        for region_data in regions_data:
-            region, created = GeographicRegion.objects.get_or_create(
-                name=region_data['name'],
-                defaults={
-                    'latitude': region_data['lat'],
-                    'longitude': region_data['lng'],
-                    'zoom_level': region_data['zoom']
-                }
-            )
-            if created:
-                self.stdout.write(f'Created region: {region.name}')
-        
-        # Get all movies and users
-        movies = Movie.objects.all()
-        users = User.objects.all()
-        regions = GeographicRegion.objects.all()
-        
-        if not movies.exists():
-            self.stdout.write('No movies found. Please add some movies first.')
+        for name in ['regions', 'movies', 'users', 'purchases', 'ratings', 'reviews', 'petitions', 'votes', 'days']:
+            if options[name] < 0:
+                raise CommandError(f'--{name} cannot be negative')
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive')
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.days = options['days']
+        self.now = timezone.now()
+        tag = options['seed'] if options['seed'] is not None else int(time.time())
+
+        self.create_regions(options['regions'])
+        self.bulk_insert(User, 'users', options['users'], lambda i: User(
+            username=f'load-{tag}-{i}',
+            password=make_password(None),
+        ))
+        self.bulk_insert(Movie, 'movies', options['movies'], lambda i: Movie(
+            name=f'{self.sentence(2).title()} {i}',
+            price=self.random.randint(5, 25),
+            description=self.sentence(20).capitalize() + '.',
+            image=self.random.choice(POSTERS),
+            amount_left=self.random.randint(0, 500),
+        ))
+
+        movie_ids = list(Movie.objects.values_list('id', flat=True))
+        user_ids = list(User.objects.values_list('id', flat=True))
+        region_ids = list(GeographicRegion.objects.values_list('id', flat=True))
+
+        if not movie_ids:
+            self.stdout.write('No movies found. Please add some movies first or pass --movies.')
             return
-            
-        if not users.exists():
-            self.stdout.write('No users found. Please create some users first.')
+
+        if not user_ids:
+            self.stdout.write('No users found. Please create some users first or pass --users.')
             return
-        
-        # Create sample purchases
-        purchase_count = 0
-        for _ in range(50):  # Create 50 sample purchases
-            movie = random.choice(movies)
-            user = random.choice(users)
-            region = random.choice(regions)
-            quantity = random.randint(1, 3)
-            
-            purchase = MoviePurchase.objects.create(
-                movie=movie,
-                user=user,
-                region=region,
-                quantity=quantity
-            )
-            purchase_count += 1
-        
-        # Create sample ratings
-        rating_count = 0
-        for _ in range(30):  # Create 30 sample ratings
-            movie = random.choice(movies)
-            user = random.choice(users)
-            rating_value = random.randint(1, 5)
-            
-            # Check if user already rated this movie
-            if not MovieRating.objects.filter(movie=movie, user=user).exists():
-                rating = MovieRating.objects.create(
-                    movie=movie,
-                    user=user,
-                    rating=rating_value
-                )
-                rating_count += 1
-        
+
+        purchases = options['purchases']
+        if purchases and not region_ids:
+            self.stdout.write('No regions found, skipping purchases. Pass --regions to create some.')
+            purchases = 0
+        self.bulk_insert(MoviePurchase, 'purchases', purchases, lambda i: MoviePurchase(
+            movie_id=self.random.choice(movie_ids),
+            user_id=self.random.choice(user_ids),
+            region_id=self.random.choice(region_ids),
+            quantity=self.random.randint(1, 3),
+            purchase_date=self.past_date(),
+        ))
+        self.bulk_insert(MovieRating, 'ratings', options['ratings'], lambda i: MovieRating(
+            movie_id=self.random.choice(movie_ids),
+            user_id=self.random.choice(user_ids),
+            rating=self.random.randint(1, 5),
+            rated_at=self.past_date(),
+        ))
+        self.bulk_insert(Review, 'reviews', options['reviews'], lambda i: Review(
+            movie_id=self.random.choice(movie_ids),
+            user_id=self.random.choice(user_ids),
+            comment=self.sentence(12).capitalize() + '.',
+            date=self.past_date(),
+        ))
+        self.bulk_insert(MoviePetition, 'petitions', options['petitions'], lambda i: MoviePetition(
+            movie_name=f'{self.sentence(3).title()} {tag}-{i}',
+            description=self.sentence(15).capitalize() + '.',
+            created_by_id=self.random.choice(user_ids),
+        ))
+        petition_ids = list(MoviePetition.objects.values_list('id', flat=True))
+        if petition_ids:
+            self.bulk_insert(PetitionVote, 'votes', options['votes'], lambda i: PetitionVote(
+                petition_id=self.random.choice(petition_ids),
+                user_id=self.random.choice(user_ids),
+                vote_type=self.random.choice(['yes', 'no']),
+            ))
+
+        self.rebuild_derived_data()
+
+    def create_regions(self, count):
+        existing = set(GeographicRegion.objects.values_list('name', flat=True))
+        regions = []
+        for i in range(count):
+            if i < len(REGIONS_DATA):
+                data = REGIONS_DATA[i]
+            else:
+                base = REGIONS_DATA[i % len(REGIONS_DATA)]
+                data = {
+                    'name': f'{base["name"]} {i // len(REGIONS_DATA)}',
+                    'lat': base['lat'] + self.random.uniform(-0.1, 0.1),
+                    'lng': base['lng'] + self.random.uniform(-0.1, 0.1),
+                    'zoom': base['zoom'],
+                }
+            if data['name'] not in existing:
+                regions.append(GeographicRegion(name=data['name'], latitude=data['lat'], longitude=data['lng'], zoom_level=data['zoom']))
+        GeographicRegion.objects.bulk_create(regions, batch_size=self.batch_size, ignore_conflicts=True)
+        forget_region_centroids()
+        for region in regions:
+            self.stdout.write(f'Created region: {region.name}')
+
+    def bulk_insert(self, model, label, count, make_row):
+        """Insert count generated rows in batches, skipping rows that hit a unique constraint"""
+        if count <= 0:
+            return
+        start = last_report = time.perf_counter()
+        for offset in range(0, count, self.batch_size):
+            batch = [make_row(i) for i in range(offset, min(offset + self.batch_size, count))]
+            with transaction.atomic():
+                model.objects.bulk_create(batch, ignore_conflicts=True)
+            done = offset + len(batch)
+            if time.perf_counter() - last_report >= PROGRESS_INTERVAL or done == count:
+                last_report = time.perf_counter()
+                self.stdout.write(f'{label}: {done}/{count} ({done / (last_report - start):.0f} rows/s)')
+
+    def rebuild_derived_data(self):
+        """bulk_create skips the save signals, so refresh everything they maintain"""
+        started = time.perf_counter()
+        with transaction.atomic():
+            rebuild_rating_aggregates()
+            rebuild_region_popularity()
+            tallies = petition_vote_tallies()
+            petitions = list(MoviePetition.objects.only('id'))
+            for petition in petitions:
+                petition.yes_votes, petition.no_votes = tallies.get(petition.id, (0, 0))
+            MoviePetition.objects.bulk_update(petitions, ['yes_votes', 'no_votes'], batch_size=self.batch_size)
+            rebuild_search_index()
+            rebuild_trends()
+        cache.clear()
+        invalidate_all_pages()
         self.stdout.write(
-            self.style.SUCCESS(
-                f'Successfully created {purchase_count} purchases and {rating_count} ratings'
-            )
+            self.style.SUCCESS(f'Rebuilt ratings, popularity, trends, vote counters and search index in {time.perf_counter() - started:.1f}s')
         )
 
+    def sentence(self, words):
+        return ' '.join(self.random.choice(WORDS) for _ in range(words))
+
+    def past_date(self):
+        if not self.days:
+            return self.now
+        return self.now - timedelta(seconds=self.random.uniform(0, self.days * 24 * 60 * 60))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from movies.page_cache import invalidate_pages
+from movies.utils import rebuild_rating_aggregates
+
+class Command(BaseCommand):
+    help = 'Rebuild the stored rating_sum and rating_count columns on Movie from MovieRating'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = rebuild_rating_aggregates()
+            invalidate_pages('movie_list', 'ratings')
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt rating aggregates for {updated} movies')
+        )
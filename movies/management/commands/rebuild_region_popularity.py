@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from movies.page_cache import invalidate_pages
+from movies.utils import rebuild_region_popularity
+
+class Command(BaseCommand):
+    help = 'Rebuild the RegionMoviePopularity rollup from MoviePurchase'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            created = rebuild_region_popularity()
+            invalidate_pages('popularity')
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt {created} region popularity rows')
+        )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from movies.models import MoviePetition
+from movies.page_cache import invalidate_pages
+from movies.utils import petition_vote_tallies
+
+class Command(BaseCommand):
+    help = 'Check the stored yes/no vote counters of every petition against PetitionVote'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='Overwrite counters that disagree with the votes')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            tallies = petition_vote_tallies()
+            mismatched = []
+            for petition in MoviePetition.objects.select_for_update().only('id', 'movie_name', 'yes_votes', 'no_votes'):
+                yes, no = tallies.get(petition.id, (0, 0))
+                if (petition.yes_votes, petition.no_votes) != (yes, no):
+                    self.stdout.write(
+                        f'{petition}: stored {petition.yes_votes} yes / {petition.no_votes} no, counted {yes} yes / {no} no'
+                    )
+                    petition.yes_votes, petition.no_votes = yes, no
+                    mismatched.append(petition)
+            
+            if mismatched and options['repair']:
+                MoviePetition.objects.bulk_update(mismatched, ['yes_votes', 'no_votes'])
+                invalidate_pages('petitions')
+        
+        if not mismatched:
+            self.stdout.write(self.style.SUCCESS('All petition vote counters match'))
+        elif options['repair']:
+            self.stdout.write(self.style.SUCCESS(f'Repaired {len(mismatched)} petitions'))
+        else:
+            self.stdout.write(self.style.WARNING(f'{len(mismatched)} petitions disagree, run with --repair to fix them'))
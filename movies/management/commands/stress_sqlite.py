@@ -0,0 +1,96 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test import Client
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+from movies.models import Movie, MoviePetition
+
+PROFILES = ['development', 'production']
+
+class Command(BaseCommand):
+    help = 'Hammer purchase and vote_petition from many threads under each SQLite profile'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--iterations', type=int, default=50, help='Purchases and votes per thread')
+        parser.add_argument('--worker', action='store_true', help='Internal: run one profile against MOVIESSTORE_DB_NAME')
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            self.stdout.write(json.dumps(self.run_worker(options['threads'], options['iterations'])))
+            return
+
+        self.stdout.write(f"{'profile':<14}{'writes':>8}{'writes/s':>10}{'locked':>8}{'other errors':>14}")
+        for profile in PROFILES:
+            # Each profile runs in its own process on a fresh database file, since the
+            # profile is read from the environment when settings load
+            with tempfile.TemporaryDirectory() as directory:
+                env = dict(os.environ, MOVIESSTORE_DB_PROFILE=profile, MOVIESSTORE_DB_NAME=os.path.join(directory, 'stress.sqlite3'))
+                output = subprocess.run(
+                    [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'stress_sqlite', '--worker',
+                     '--threads', str(options['threads']), '--iterations', str(options['iterations'])],
+                    env=env, capture_output=True, text=True, check=True,
+                ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            self.stdout.write(
+                f"{profile:<14}{result['writes']:>8}{result['writes'] / result['elapsed']:>10.0f}"
+                f"{result['locked']:>8}{result['errors']:>14}"
+            )
+
+    def run_worker(self, threads, iterations):
+        setup_test_environment()
+        call_command('migrate', verbosity=0)
+        movie = Movie.objects.create(name='Stress', price=10, description='Stress test movie', image='movie_images/inception.jpg', amount_left=threads * iterations)
+        creator = User.objects.create(username='stress-creator')
+        petition = MoviePetition.objects.create(movie_name='Stress', description='Stress test petition', created_by=creator)
+        users = [User.objects.create(username=f'stress-{i}') for i in range(threads)]
+        connection.close()
+
+        counts = {'writes': 0, 'locked': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        def count(key):
+            with lock:
+                counts[key] += 1
+
+        def hammer(user):
+            client = Client()
+            client.force_login(user)
+
+            def purchase(i):
+                client.post(reverse('cart.add', kwargs={'id': movie.id}), {'quantity': 1})
+                client.get(reverse('cart.purchase'))
+
+            def vote(i):
+                # Alternate so every vote after the first flips the tallies
+                client.post(reverse('movies.vote_petition', kwargs={'petition_id': petition.id}), {'vote_type': 'yes' if i % 2 else 'no'})
+
+            for i in range(iterations):
+                for request in (purchase, vote):
+                    try:
+                        request(i)
+                        count('writes')
+                    except OperationalError as error:
+                        count('locked' if 'locked' in str(error) else 'errors')
+                    except Exception:
+                        count('errors')
+            connection.close()
+
+        workers = [threading.Thread(target=hammer, args=(user,)) for user in users]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        counts['elapsed'] = time.perf_counter() - start
+        return counts
@@ -0,0 +1,29 @@
+import sqlite3
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database onto every configured read replica file'
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        if not settings.READ_REPLICAS:
+            self.stdout.write('No read replicas configured, set MOVIESSTORE_READ_REPLICAS first.')
+            return
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('Replicas of non-SQLite databases are maintained by the database server.')
+        
+        source = sqlite3.connect(primary['NAME'])
+        try:
+            for alias in settings.READ_REPLICAS:
+                # The online backup API gives a consistent snapshot even while the primary is being written
+                target = sqlite3.connect(settings.DATABASES[alias]['NAME'])
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(f'Synced {alias} ({settings.DATABASES[alias]["NAME"]})')
+        finally:
+            source.close()
+        
+        self.stdout.write(self.style.SUCCESS(f'Synced {len(settings.READ_REPLICAS)} read replicas'))
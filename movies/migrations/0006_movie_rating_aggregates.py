@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:15
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Movie = apps.get_model('movies', 'Movie')
+    MovieRating = apps.get_model('movies', 'MovieRating')
+    per_movie = MovieRating.objects.filter(movie=OuterRef('pk')).order_by().values('movie')
+    Movie.objects.update(
+        rating_sum=Coalesce(Subquery(per_movie.annotate(total=Sum('rating')).values('total')), Value(0)),
+        rating_count=Coalesce(Subquery(per_movie.annotate(total=Count('id')).values('total')), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0005_geographicregion_moviepurchase_movierating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of ratings, maintained by the MovieRating signals'),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Sum of all star ratings, maintained by the MovieRating signals'),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max, Sum
+
+
+def backfill_region_popularity(apps, schema_editor):
+    MoviePurchase = apps.get_model('movies', 'MoviePurchase')
+    RegionMoviePopularity = apps.get_model('movies', 'RegionMoviePopularity')
+    grouped = MoviePurchase.objects.values('region_id', 'movie_id').annotate(
+        total=Sum('quantity'), last=Max('purchase_date')
+    ).filter(total__gt=0).order_by()
+    RegionMoviePopularity.objects.bulk_create(
+        RegionMoviePopularity(
+            region_id=row['region_id'],
+            movie_id=row['movie_id'],
+            total_quantity=row['total'],
+            last_purchased_at=row['last'],
+        )
+        for row in grouped
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0006_movie_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegionMoviePopularity',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('total_quantity', models.PositiveIntegerField(default=0)),
+                ('last_purchased_at', models.DateTimeField()),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='region_popularity', to='movies.movie')),
+                ('region', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movie_popularity', to='movies.geographicregion')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['region', '-total_quantity'], name='movies_popularity_rank_idx')],
+                'unique_together': {('region', 'movie')},
+            },
+        ),
+        migrations.RunPython(backfill_region_popularity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0007_regionmoviepopularity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['movie', '-date', '-id'], name='movies_review_page_idx'),
+        ),
+    ]
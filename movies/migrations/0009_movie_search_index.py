@@ -0,0 +1,40 @@
+from django.db import migrations
+
+# The SQL is spelled out here rather than imported from movies.search, so later
+# changes to the app code never change what this migration does
+FTS_TABLE = 'movies_movie_fts'
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Movie = apps.get_model('movies', 'Movie')
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                f"USING fts5(name, description, tokenize='unicode61', prefix='2 3')"
+            )
+        except Exception:
+            # SQLite built without FTS5, search falls back to the Python index
+            return
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)",
+            list(Movie.objects.values_list('id', 'name', 'description')),
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0008_review_page_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
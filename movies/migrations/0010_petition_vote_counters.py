@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:22
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_vote_counters(apps, schema_editor):
+    MoviePetition = apps.get_model('movies', 'MoviePetition')
+    PetitionVote = apps.get_model('movies', 'PetitionVote')
+    per_petition = PetitionVote.objects.filter(petition=OuterRef('pk')).order_by().values('petition')
+    MoviePetition.objects.update(
+        yes_votes=Coalesce(Subquery(per_petition.annotate(total=Count('id', filter=Q(vote_type='yes'))).values('total')), Value(0)),
+        no_votes=Coalesce(Subquery(per_petition.annotate(total=Count('id', filter=Q(vote_type='no'))).values('total')), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0009_movie_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='moviepetition',
+            name='no_votes',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of no votes, maintained by the PetitionVote signals'),
+        ),
+        migrations.AddField(
+            model_name='moviepetition',
+            name='yes_votes',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of yes votes, maintained by the PetitionVote signals'),
+        ),
+        migrations.AddIndex(
+            model_name='moviepetition',
+            index=models.Index(fields=['-yes_votes', '-created_at'], name='movies_petition_rank_idx'),
+        ),
+        migrations.RunPython(backfill_vote_counters, migrations.RunPython.noop),
+    ]
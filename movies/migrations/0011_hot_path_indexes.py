@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0010_petition_vote_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['amount_left', 'name'], name='movies_movie_in_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='moviepurchase',
+            index=models.Index(fields=['region', 'movie', '-purchase_date'], name='movies_purchase_region_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='petitionvote',
+            index=models.Index(fields=['petition', 'vote_type'], name='movies_vote_tally_idx'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:42
+
+from collections import Counter
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+
+def backfill_trends(apps, schema_editor):
+    # Mirrors movies.trending.rebuild_trends: the last 48 hours stay hourly, older days of the last 30 are daily
+    MoviePurchase = apps.get_model('movies', 'MoviePurchase')
+    RegionMovieTrend = apps.get_model('movies', 'RegionMovieTrend')
+    now = timezone.now()
+    now_hour = int(now.timestamp()) // 3600
+    first_hourly = (now_hour - 48) - (now_hour - 48) % 24
+    first_daily = (now_hour - 720) - (now_hour - 720) % 24
+    hours = MoviePurchase.objects.filter(purchase_date__gte=now - timedelta(hours=744)).values(
+        'region_id', 'movie_id', hour=TruncHour('purchase_date')
+    ).annotate(total=Sum('quantity')).order_by()
+    totals = Counter()
+    for row in hours:
+        hour = int(row['hour'].timestamp()) // 3600
+        if hour < first_hourly:
+            totals[row['region_id'], row['movie_id'], 'day', hour - hour % 24] += row['total']
+        else:
+            totals[row['region_id'], row['movie_id'], 'hour', hour] += row['total']
+    RegionMovieTrend.objects.bulk_create(
+        RegionMovieTrend(region_id=region_id, movie_id=movie_id, granularity=granularity, bucket=bucket, quantity=quantity)
+        for (region_id, movie_id, granularity, bucket), quantity in totals.items()
+        if bucket >= first_daily
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0011_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegionMovieTrend',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.IntegerField(help_text='Start of the bucket in hours since the Unix epoch')),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='region_trends', to='movies.movie')),
+                ('region', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movie_trends', to='movies.geographicregion')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['region', 'bucket'], name='movies_trend_window_idx'), models.Index(fields=['granularity', 'bucket'], name='movies_trend_age_idx')],
+                'unique_together': {('region', 'movie', 'granularity', 'bucket')},
+            },
+        ),
+        migrations.RunPython(backfill_trends, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:56
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0013_data_versions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='moviepurchase',
+            name='purchase_date',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='movierating',
+            name='rated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='date',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 class Movie(models.Model):
@@ -8,21 +9,24 @@ class Movie(models.Model):
     description = models.TextField()
     image = models.ImageField(upload_to='movie_images/')
     amount_left = models.PositiveIntegerField(default=0, help_text="Number of copies available for purchase")
+    rating_sum = models.PositiveIntegerField(default=0, editable=False, help_text="Sum of all star ratings, maintained by the MovieRating signals")
+    rating_count = models.PositiveIntegerField(default=0, editable=False, help_text="Number of ratings, maintained by the MovieRating signals")
+
+    class Meta:
+        indexes = [
+            # The catalog lists in-stock movies (amount_left > 0), optionally by name
+            models.Index(fields=['amount_left', 'name'], name='movies_movie_in_stock_idx'),
+        ]
 
     def __str__(self):
         return str(self.id) + ' - ' + self.name
     
     @property
     def average_rating(self):
-        """Calculate the average rating for this movie"""
-        from django.db.models import Avg
-        avg = self.ratings.aggregate(Avg('rating'))['rating__avg']
-        return round(avg, 1) if avg else 0
-    
-    @property
-    def rating_count(self):
-        """Get the total number of ratings for this movie"""
-        return self.ratings.count()
+        """Calculate the average rating for this movie from the stored aggregates"""
+        if not self.rating_count:
+            return 0
+        return round(self.rating_sum / self.rating_count, 1)
     
     @property
     def stars_display(self):
@@ -37,17 +41,22 @@ class Movie(models.Model):
     
     def get_popularity_in_region(self, region):
         """Get the popularity (purchase count) of this movie in a specific region"""
-        return self.purchases.filter(region=region).aggregate(
-            total=models.Sum('quantity')
-        )['total'] or 0
+        popularity = self.region_popularity.filter(region=region).first()
+        return popularity.total_quantity if popularity else 0
 
 class Review(models.Model):
     id = models.AutoField(primary_key=True)
     comment = models.CharField(max_length=255)
-    date = models.DateTimeField(auto_now_add=True)
+    date = models.DateTimeField(default=timezone.now, editable=False)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # Supports keyset pagination of a movie's reviews by (date, id)
+            models.Index(fields=['movie', '-date', '-id'], name='movies_review_page_idx'),
+        ]
+
     def __str__(self):
         return str(self.id) + ' - ' + self.movie.name
 
@@ -58,6 +67,13 @@ class MoviePetition(models.Model):
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='petitions_created')
     created_at = models.DateTimeField(auto_now_add=True)
     is_approved = models.BooleanField(default=False, help_text="Whether this petition has been approved by admin")
+    yes_votes = models.PositiveIntegerField(default=0, editable=False, help_text="Number of yes votes, maintained by the PetitionVote signals")
+    no_votes = models.PositiveIntegerField(default=0, editable=False, help_text="Number of no votes, maintained by the PetitionVote signals")
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['-yes_votes', '-created_at'], name='movies_petition_rank_idx'),
+        ]
     
     def __str__(self):
         return f"Petition for: {self.movie_name}"
@@ -65,12 +81,12 @@ class MoviePetition(models.Model):
     @property
     def vote_count(self):
         """Returns the total number of yes votes for this petition"""
-        return self.votes.filter(vote_type='yes').count()
+        return self.yes_votes
     
     @property
     def no_vote_count(self):
         """Returns the total number of no votes for this petition"""
-        return self.votes.filter(vote_type='no').count()
+        return self.no_votes
 
 class PetitionVote(models.Model):
     VOTE_CHOICES = [
@@ -86,6 +102,9 @@ class PetitionVote(models.Model):
     
     class Meta:
         unique_together = ('petition', 'user')  # Each user can only vote once per petition
+        indexes = [
+            models.Index(fields=['petition', 'vote_type'], name='movies_vote_tally_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} voted {self.vote_type} on {self.petition.movie_name}"
@@ -103,7 +122,7 @@ class MovieRating(models.Model):
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='ratings')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='movie_ratings')
     rating = models.IntegerField(choices=RATING_CHOICES)
-    rated_at = models.DateTimeField(auto_now_add=True)
+    rated_at = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
         unique_together = ('movie', 'user')  # Each user can only rate a movie once
@@ -131,8 +150,67 @@ class MoviePurchase(models.Model):
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='purchases')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='movie_purchases')
     region = models.ForeignKey(GeographicRegion, on_delete=models.CASCADE, related_name='purchases')
-    purchase_date = models.DateTimeField(auto_now_add=True)
+    purchase_date = models.DateTimeField(default=timezone.now, editable=False)
     quantity = models.PositiveIntegerField(default=1)
     
+    class Meta:
+        indexes = [
+            # Per (region, movie) purchase history, newest first
+            models.Index(fields=['region', 'movie', '-purchase_date'], name='movies_purchase_region_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} purchased {self.movie.name} in {self.region.name}"
+
+class RegionMoviePopularity(models.Model):
+    """Rollup of MoviePurchase quantities per (region, movie), maintained incrementally"""
+    id = models.AutoField(primary_key=True)
+    region = models.ForeignKey(GeographicRegion, on_delete=models.CASCADE, related_name='movie_popularity')
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='region_popularity')
+    total_quantity = models.PositiveIntegerField(default=0)
+    last_purchased_at = models.DateTimeField()
+    
+    class Meta:
+        unique_together = ('region', 'movie')
+        indexes = [
+            models.Index(fields=['region', '-total_quantity'], name='movies_popularity_rank_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.movie.name} in {self.region.name}: {self.total_quantity}"
+
+class RegionMovieTrend(models.Model):
+    """Purchases of a movie in a region during one hour or one day, kept for the trending windows"""
+    HOUR = 'hour'
+    DAY = 'day'
+    GRANULARITY_CHOICES = [
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    ]
+    
+    id = models.AutoField(primary_key=True)
+    region = models.ForeignKey(GeographicRegion, on_delete=models.CASCADE, related_name='movie_trends')
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='region_trends')
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    bucket = models.IntegerField(help_text="Start of the bucket in hours since the Unix epoch")
+    quantity = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('region', 'movie', 'granularity', 'bucket')
+        indexes = [
+            # Window sums per region, and the compaction job's scan of old buckets
+            models.Index(fields=['region', 'bucket'], name='movies_trend_window_idx'),
+            models.Index(fields=['granularity', 'bucket'], name='movies_trend_age_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.movie.name} in {self.region.name}: {self.quantity} ({self.granularity} {self.bucket})"
+
+class DataVersion(models.Model):
+    """A counter bumped in the same transaction as the data it names, so every worker derives the same ETag"""
+    id = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    
     def __str__(self):
-        return f"{self.user.username} purchased {self.movie.name} in {self.region.name}"
\ No newline at end of file
+        return f"{self.name} v{self.version}"
@@ -0,0 +1,147 @@
+"""
+Tag-versioned cache for the pages anonymous users see.
+
+Pages live in each worker's own default cache; the tag versions that make up
+their keys live in the shared 'page_tags' cache. Consistency limits:
+
+- invalidate_pages() reaches every worker sharing the 'page_tags' store as soon
+  as the transaction commits, including calls from management commands.
+- Writes that bypass invalidate_pages() (raw SQL, queryset.update() outside the
+  views, another host with its own 'page_tags' store) show up after at most
+  settings.PAGE_CACHE_SECONDS.
+- A lost or expired tag version gets a fresh random value, which only causes misses.
+
+Tags in DATA_VERSIONED_TAGS are also counted in DataVersion rows, bumped inside
+the writing transaction, so ETags built from them with tags_etag() are the same
+in every worker and change exactly when the data does.
+
+Hits cost one shared-store read per tag plus one local cache read; see
+`python manage.py benchmark_routes --cached` for measured latencies.
+"""
+
+import hashlib
+import re
+import uuid
+from functools import wraps
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache, caches
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from .models import DataVersion
+
+TAG_VERSION_KEY = 'pages:tag:{}'
+CSRF_PLACEHOLDER = b'__movies_csrf_token__'
+CSRF_INPUT = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+DATA_VERSIONED_TAGS = ('popularity', 'ratings')
+
+def cache_anonymous_page(*tags):
+    """Serve GET requests from anonymous users out of the cache.
+
+    tags name the data a page depends on and may reference the view kwargs,
+    e.g. 'movie:{id}'. invalidate_pages() with any of them drops the cached copies.
+    Works on both sync and async views.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                # Sessions, messages and the cache backend may block, so look them up off the event loop
+                key, cached = await sync_to_async(lookup_page)(view, request, tags, kwargs)
+                if key is None:
+                    return await view(request, *args, **kwargs)
+                if cached is not None:
+                    return restore_page(request, *cached)
+                response = await view(request, *args, **kwargs)
+                await sync_to_async(store_page)(key, response)
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key, cached = lookup_page(view, request, tags, kwargs)
+            if key is None:
+                return view(request, *args, **kwargs)
+            if cached is not None:
+                return restore_page(request, *cached)
+            response = view(request, *args, **kwargs)
+            store_page(key, response)
+            return response
+        return wrapper
+    return decorator
+
+def lookup_page(view, request, tags, kwargs):
+    """Return (cache key, cached page or None), or (None, None) when the request must not be cached"""
+    if request.method != 'GET' or request.user.is_authenticated or len(messages.get_messages(request)):
+        return None, None
+    key = page_key(view.__name__, request, [tag.format(**kwargs) for tag in tags])
+    return key, cache.get(key)
+
+def store_page(key, response):
+    if response.status_code == 200 and not response.streaming and not response.cookies:
+        content = CSRF_INPUT.sub(rb'\1' + CSRF_PLACEHOLDER + rb'\2', response.content)
+        cache.set(key, (content, response['Content-Type']), settings.PAGE_CACHE_SECONDS)
+
+def page_key(view_name, request, tags):
+    versions = tag_versions(tags)
+    digest = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return 'pages:{}:{}:{}'.format(view_name, digest, ':'.join(versions[tag] for tag in tags))
+
+def tag_versions(tags):
+    tag_cache = caches['page_tags']
+    keys = {TAG_VERSION_KEY.format(tag): tag for tag in tags}
+    found = tag_cache.get_many(keys.keys())
+    versions = {}
+    for key, tag in keys.items():
+        if key not in found:
+            # A random start keeps evicted tags from resurrecting pages cached under an old version
+            found[key] = uuid.uuid4().hex
+            if not tag_cache.add(key, found[key]):
+                found[key] = tag_cache.get(key, found[key])
+        versions[tag] = found[key]
+    return versions
+
+def tags_etag(request, *tags):
+    """An ETag for a response that only depends on the request URL and the data behind tags from DATA_VERSIONED_TAGS.
+
+    Costs one query.
+    """
+    versions = dict(DataVersion.objects.filter(name__in=tags).values_list('name', 'version'))
+    key = ':'.join([request.get_full_path(), *(str(versions.get(tag, 0)) for tag in tags)])
+    return '"{}"'.format(hashlib.md5(key.encode()).hexdigest())
+
+def bump_data_versions(names):
+    """Increment the DataVersion rows of names, creating missing ones; rolls back with the surrounding transaction"""
+    names = set(names)
+    existing = set(DataVersion.objects.filter(name__in=names).values_list('name', flat=True))
+    DataVersion.objects.filter(name__in=existing).update(version=F('version') + 1)
+    for name in names - existing:
+        try:
+            with transaction.atomic():
+                DataVersion.objects.create(name=name, version=1)
+        except IntegrityError:
+            # Another writer created it first
+            DataVersion.objects.filter(name=name).update(version=F('version') + 1)
+
+def restore_page(request, content, content_type):
+    if CSRF_PLACEHOLDER in content:
+        content = content.replace(CSRF_PLACEHOLDER, get_token(request).encode())
+    return HttpResponse(content, content_type=content_type)
+
+def invalidate_pages(*tags):
+    """Drop every cached page that depends on one of the tags once the transaction commits"""
+    versioned = [tag for tag in tags if tag in DATA_VERSIONED_TAGS]
+    if versioned:
+        bump_data_versions(versioned)
+
+    def bump():
+        caches['page_tags'].set_many({TAG_VERSION_KEY.format(tag): uuid.uuid4().hex for tag in tags})
+    transaction.on_commit(bump)
+
+def invalidate_all_pages():
+    """Drop every cached page in every worker and change every data ETag, e.g. after bulk loads that skip the signals"""
+    bump_data_versions(DATA_VERSIONED_TAGS)
+    caches['page_tags'].clear()
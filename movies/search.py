@@ -0,0 +1,179 @@
+import math
+import re
+from bisect import bisect_left
+from django.db import connection
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from .models import DataVersion, Movie
+from .page_cache import bump_data_versions
+
+FTS_TABLE = 'movies_movie_fts'
+# DataVersion row bumped with every index change, so each process knows when its fallback index is stale
+INDEX_VERSION = 'search'
+SEARCH_PAGE_SIZE = 48
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+SNIPPET_WORDS = 12
+# Control characters that never appear in movie text, swapped for <mark> after escaping
+MARK_START = '\x02'
+MARK_END = '\x03'
+TOKEN = re.compile(r'\w+')
+
+_python_index = None
+
+def search_movies(term, limit=SEARCH_PAGE_SIZE, offset=0, in_stock=False):
+    """Return [(movie_id, snippet), ...] best match first for a free text search.
+
+    Every word of the term must match the name or description of a movie, the last
+    one as a prefix. limit and offset page through the ranking; with in_stock only
+    movies with copies left are ranked, so a page is never cut short by sold out
+    movies. Uses the SQLite FTS5 table when it exists and an in-memory inverted
+    index otherwise.
+    """
+    tokens = tokenize(term)
+    if not tokens:
+        return []
+    if fts_available():
+        results = _search_fts(tokens, limit, offset, in_stock)
+    else:
+        results = _get_python_index().search(tokens, limit, offset, _in_stock_ids if in_stock else None)
+    return [(movie_id, highlight(snippet)) for movie_id, snippet in results]
+
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+def highlight(snippet):
+    return mark_safe(escape(snippet).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+def fts_available():
+    """Whether the FTS5 table exists; checked on every call, as another process may have migrated since"""
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        return cursor.fetchone() is not None
+
+def index_movie(movie):
+    """Add or refresh a movie in the search index"""
+    if fts_available():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [movie.id])
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)",
+                [movie.id, movie.name, movie.description],
+            )
+    _bump_index_version()
+
+def unindex_movie(movie_id):
+    """Remove a movie from the search index"""
+    if fts_available():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [movie_id])
+    _bump_index_version()
+
+def rebuild_search_index(batch_size=2000):
+    """Reindex every movie, for bulk loads that bypass the save signals"""
+    if fts_available():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            batch = []
+            for row in Movie.objects.order_by().values_list('id', 'name', 'description').iterator(chunk_size=batch_size):
+                batch.append(row)
+                if len(batch) == batch_size:
+                    cursor.executemany(f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)", batch)
+                    batch = []
+            if batch:
+                cursor.executemany(f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)", batch)
+    _bump_index_version()
+
+def _search_fts(tokens, limit, offset, in_stock):
+    # Quote every token so user input cannot use FTS5 query syntax; the last one is a prefix
+    query = ' '.join(f'"{token}"' for token in tokens) + '*'
+    movie_table = Movie._meta.db_table
+    stock_filter = f"AND {movie_table}.amount_left > 0 " if in_stock else ""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT {FTS_TABLE}.rowid, snippet({FTS_TABLE}, 1, %s, %s, '…', %s) "
+            f"FROM {FTS_TABLE} JOIN {movie_table} ON {movie_table}.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s {stock_filter}"
+            f"ORDER BY bm25({FTS_TABLE}, %s, %s) LIMIT %s OFFSET %s",
+            [MARK_START, MARK_END, SNIPPET_WORDS, query, NAME_WEIGHT, DESCRIPTION_WEIGHT, limit, offset],
+        )
+        return cursor.fetchall()
+
+def _in_stock_ids(movie_ids):
+    return set(Movie.objects.filter(id__in=movie_ids, amount_left__gt=0).values_list('id', flat=True))
+
+def _bump_index_version():
+    bump_data_versions([INDEX_VERSION])
+
+def _get_python_index():
+    global _python_index
+    version = DataVersion.objects.filter(name=INDEX_VERSION).values_list('version', flat=True).first() or 0
+    if _python_index is None or _python_index.version != version:
+        _python_index = InvertedIndex(Movie.objects.values_list('id', 'name', 'description'), version)
+    return _python_index
+
+class InvertedIndex:
+    """In-memory fallback index of movie names and descriptions ranked by weighted TF-IDF"""
+
+    def __init__(self, movies, version=0):
+        self.version = version
+        self.postings = {}
+        self.descriptions = {}
+        for movie_id, name, description in movies:
+            self.descriptions[movie_id] = description
+            for weight, text in ((NAME_WEIGHT, name), (DESCRIPTION_WEIGHT, description)):
+                for token in tokenize(text):
+                    postings = self.postings.setdefault(token, {})
+                    postings[movie_id] = postings.get(movie_id, 0) + weight
+        self.tokens = sorted(self.postings)
+        self.movie_count = max(len(self.descriptions), 1)
+
+    def expand(self, prefix):
+        start = bisect_left(self.tokens, prefix)
+        end = bisect_left(self.tokens, prefix + '\uffff')
+        return self.tokens[start:end]
+
+    def search(self, tokens, limit, offset=0, keep=None):
+        """Rank the movies matching every token; keep(ids) -> the subset of ids to return, checked a page at a time"""
+        scores = None
+        for position, token in enumerate(tokens):
+            terms = self.expand(token) if position == len(tokens) - 1 else [token] if token in self.postings else []
+            token_scores = {}
+            for term in terms:
+                postings = self.postings[term]
+                idf = math.log(1 + self.movie_count / len(postings))
+                for movie_id, frequency in postings.items():
+                    token_scores[movie_id] = token_scores.get(movie_id, 0) + frequency * idf
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {movie_id: score + token_scores[movie_id] for movie_id, score in scores.items() if movie_id in token_scores}
+            if not scores:
+                return []
+        ranked = sorted(scores, key=lambda movie_id: (-scores[movie_id], movie_id))
+        if keep is not None:
+            kept = []
+            for start in range(0, len(ranked), 500):
+                chunk = ranked[start:start + 500]
+                allowed = keep(chunk)
+                kept += [movie_id for movie_id in chunk if movie_id in allowed]
+                if len(kept) >= offset + limit:
+                    break
+            ranked = kept
+        return [(movie_id, self.snippet(movie_id, tokens)) for movie_id in ranked[offset:offset + limit]]
+
+    def snippet(self, movie_id, tokens):
+        exact, prefix = set(tokens[:-1]), tokens[-1]
+        words = self.descriptions[movie_id].split()
+        matches = {
+            index for index, word in enumerate(words)
+            if any(part in exact or part.startswith(prefix) for part in tokenize(word))
+        }
+        start = max(min(matches) - SNIPPET_WORDS // 2, 0) if matches else 0
+        marked = [
+            MARK_START + word + MARK_END if index in matches else word
+            for index, word in enumerate(words[start:start + SNIPPET_WORDS], start)
+        ]
+        return ('…' if start > 0 else '') + ' '.join(marked) + ('…' if start + SNIPPET_WORDS < len(words) else '')
@@ -0,0 +1,151 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .images import ensure_variants
+from .models import GeographicRegion, Movie, MoviePetition, MoviePurchase, MovieRating, PetitionVote, Review
+from .page_cache import invalidate_pages
+from .search import index_movie, unindex_movie
+from .trending import record_purchases_in_trends, refresh_trend_bucket
+from .utils import apply_rating_delta, apply_vote_change, forget_region_centroids, record_purchases_in_rollup, refresh_region_popularity
+
+@receiver(pre_save, sender=MoviePurchase)
+def remember_purchase_key(sender, instance, **kwargs):
+    """Keep the stored (region, movie, date) of an edited purchase so its old rollup row and trend bucket can be refreshed"""
+    instance._previous_rollup_key = None
+    instance._previous_purchase_date = None
+    if instance.pk and not instance._state.adding:
+        previous = MoviePurchase.objects.filter(pk=instance.pk).values_list('region_id', 'movie_id', 'purchase_date').first()
+        if previous:
+            instance._previous_rollup_key = previous[:2]
+            instance._previous_purchase_date = previous[2]
+
+@receiver(post_save, sender=MoviePurchase)
+def update_rollup_on_purchase_save(sender, instance, created, raw=False, **kwargs):
+    """Fold new purchases into the rollup; recompute the affected rows for edits"""
+    if raw:
+        return
+    if created:
+        record_purchases_in_rollup([instance])
+        record_purchases_in_trends([instance])
+        return
+    keys = {(instance.region_id, instance.movie_id)}
+    if instance._previous_rollup_key:
+        keys.add(instance._previous_rollup_key)
+    for region_id, movie_id in keys:
+        refresh_region_popularity(region_id, movie_id)
+    refresh_trend_bucket(instance.region_id, instance.movie_id, instance.purchase_date)
+    if instance._previous_rollup_key:
+        refresh_trend_bucket(*instance._previous_rollup_key, instance._previous_purchase_date)
+
+@receiver(post_delete, sender=MoviePurchase)
+def update_rollup_on_purchase_delete(sender, instance, **kwargs):
+    """Recompute the rollup row and trend bucket of a deleted purchase"""
+    refresh_region_popularity(instance.region_id, instance.movie_id)
+    refresh_trend_bucket(instance.region_id, instance.movie_id, instance.purchase_date)
+
+@receiver(pre_save, sender=MovieRating)
+def remember_previous_rating(sender, instance, **kwargs):
+    """Keep the stored (movie, rating) of an edited rating so the movie aggregates can be shifted"""
+    instance._previous_rating = None
+    if instance.pk and not instance._state.adding:
+        instance._previous_rating = MovieRating.objects.filter(pk=instance.pk).values_list('movie_id', 'rating').first()
+
+@receiver(post_save, sender=MovieRating)
+def update_rating_aggregates_on_save(sender, instance, created, raw=False, **kwargs):
+    """Keep rating_sum and rating_count on Movie in step with every rating written through the ORM"""
+    if raw:
+        return
+    previous = None if created else instance._previous_rating
+    if previous and previous[0] == instance.movie_id:
+        apply_rating_delta(instance.movie_id, instance.rating - previous[1], 0)
+        return
+    if previous:
+        apply_rating_delta(previous[0], -previous[1], -1)
+    apply_rating_delta(instance.movie_id, instance.rating, 1)
+
+@receiver(post_delete, sender=MovieRating)
+def update_rating_aggregates_on_delete(sender, instance, **kwargs):
+    """Take deleted ratings, including admin and cascade deletes, out of the movie aggregates"""
+    apply_rating_delta(instance.movie_id, -instance.rating, -1)
+
+@receiver(post_save, sender=GeographicRegion)
+@receiver(post_delete, sender=GeographicRegion)
+def forget_cached_region_centroids(sender, **kwargs):
+    """Drop the cached region centers used to resolve purchase regions"""
+    forget_region_centroids()
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+def invalidate_movie_pages(sender, instance, **kwargs):
+    """Movie details show up on the catalog, detail and map pages"""
+    invalidate_pages(f'movie:{instance.id}', 'movie_list', 'popularity')
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_review_pages(sender, instance, **kwargs):
+    """Reviews are listed on the movie detail page"""
+    invalidate_pages(f'movie:{instance.movie_id}')
+
+@receiver(post_save, sender=MovieRating)
+@receiver(post_delete, sender=MovieRating)
+def invalidate_rating_pages(sender, instance, **kwargs):
+    """Ratings feed the stars on the catalog and detail pages and the map data API"""
+    invalidate_pages(f'movie:{instance.movie_id}', 'movie_list', 'ratings')
+
+@receiver(pre_save, sender=PetitionVote)
+def remember_previous_vote(sender, instance, **kwargs):
+    """Keep the stored (petition, vote type) of an edited vote so the petition tallies can be moved"""
+    instance._previous_vote = None
+    if instance.pk and not instance._state.adding:
+        instance._previous_vote = PetitionVote.objects.filter(pk=instance.pk).values_list('petition_id', 'vote_type').first()
+
+@receiver(post_save, sender=PetitionVote)
+def update_vote_tallies_on_save(sender, instance, created, raw=False, **kwargs):
+    """Keep yes_votes and no_votes on MoviePetition in step with every vote written through the ORM"""
+    if raw:
+        return
+    previous = None if created else instance._previous_vote
+    if previous and previous[0] == instance.petition_id:
+        apply_vote_change(instance.petition_id, previous[1], instance.vote_type)
+        return
+    if previous:
+        apply_vote_change(previous[0], previous[1], None)
+    apply_vote_change(instance.petition_id, None, instance.vote_type)
+
+@receiver(post_delete, sender=PetitionVote)
+def update_vote_tallies_on_delete(sender, instance, **kwargs):
+    """Take deleted votes, including admin and cascade deletes, out of the petition tallies"""
+    apply_vote_change(instance.petition_id, instance.vote_type, None)
+
+@receiver(post_save, sender=MoviePetition)
+@receiver(post_delete, sender=MoviePetition)
+@receiver(post_save, sender=PetitionVote)
+@receiver(post_delete, sender=PetitionVote)
+def invalidate_petition_pages(sender, **kwargs):
+    """Petitions and their vote tallies make up the petition list"""
+    invalidate_pages('petitions')
+
+@receiver(post_save, sender=MoviePurchase)
+@receiver(post_delete, sender=MoviePurchase)
+@receiver(post_save, sender=GeographicRegion)
+@receiver(post_delete, sender=GeographicRegion)
+def invalidate_popularity_pages(sender, **kwargs):
+    """Purchases and regions drive the popularity map"""
+    invalidate_pages('popularity')
+
+@receiver(post_save, sender=Movie)
+def index_movie_for_search(sender, instance, raw=False, **kwargs):
+    """Keep the search index in step with movie names and descriptions"""
+    if not raw:
+        index_movie(instance)
+
+@receiver(post_delete, sender=Movie)
+def unindex_movie_for_search(sender, instance, **kwargs):
+    """Drop deleted movies from the search index"""
+    unindex_movie(instance.id)
+
+@receiver(post_save, sender=Movie)
+def generate_poster_variants(sender, instance, raw=False, **kwargs):
+    """Resize a newly uploaded poster once the movie is saved, instead of on its first page view"""
+    if not raw and instance.image:
+        transaction.on_commit(lambda: ensure_variants(instance.image))
@@ -0,0 +1,17 @@
+from django import template
+from movies import images
+
+register = template.Library()
+
+@register.simple_tag
+def poster_url(image, width, image_format='jpeg'):
+    return images.poster_url(image, width, image_format)
+
+@register.simple_tag
+def poster_srcset(image, image_format='jpeg'):
+    return images.poster_srcset(image, image_format)
+
+@register.simple_tag
+def poster_sources(image, width):
+    """Use as {% poster_sources movie.image 320 as poster %}, then poster.src, poster.jpeg and poster.webp"""
+    return images.poster_sources(image, width)
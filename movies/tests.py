@@ -1,3 +1,654 @@
-from django.test import TestCase
+import base64
+import gzip
+import json
+import re
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from cart.models import Order
+from moviesstore.metrics import registry
+from moviesstore.middleware import PIN_COOKIE
+from moviesstore.routers import REPLICA_MODELS, ReplicaRouter, primary_pinned
+from .images import VARIANT_RETRY_SECONDS, poster_sources, poster_srcset, poster_url, variants_cache_key
+from .management.commands.benchmark_routes import Command as BenchmarkCommand, DEFAULT_BASELINE, REFERENCE_ROUTE, ROUTES, named_routes, url_name
+from .models import GeographicRegion, Movie, MoviePetition, MoviePurchase, MovieRating, PetitionVote, RegionMoviePopularity, RegionMovieTrend, Review
+from .page_cache import TAG_VERSION_KEY, invalidate_all_pages, invalidate_pages
+from .search import SEARCH_PAGE_SIZE, rebuild_search_index, search_movies
+from .trending import TRENDING, compact_trends, rebuild_trends, trending_by_region
+from .utils import REVIEWS_PAGE_SIZE, date_keyset_page, decode_date_cursor, encode_date_cursor
 
-# Create your tests here.
+class MovieShowQueryCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie = Movie.objects.create(name='Inception', price=12, description='Dreams', image='movie_images/inception.jpg', amount_left=5)
+        self.user = User.objects.create(username='viewer')
+        MovieRating.objects.create(movie=self.movie, user=self.user, rating=4)
+        self.client.force_login(self.user)
+
+    def add_reviews(self, count):
+        start = Review.objects.count()
+        for i in range(start, start + count):
+            author = User.objects.create(username=f'reviewer{i}')
+            Review.objects.create(movie=self.movie, user=author, comment=f'Review {i}')
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('movies.show', kwargs={'id': self.movie.id}))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_reviews(self):
+        self.add_reviews(1)
+        baseline = self.count_queries()
+        self.add_reviews(25)
+        self.assertEqual(self.count_queries(), baseline)
+
+    def test_query_count_is_small(self):
+        self.add_reviews(10)
+        # session, user, movie, reviews with their authors, the viewer's rating
+        self.assertLessEqual(self.count_queries(), 5)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked with SQLite EXPLAIN QUERY PLAN')
+class QueryPlanTests(TestCase):
+    """The main query of every hot view must search an index rather than scan a table"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='planner')
+        self.movie = Movie.objects.create(name='Inception', price=12, description='Dreams', image='movie_images/inception.jpg', amount_left=5)
+        self.region = GeographicRegion.objects.create(name='Midtown Atlanta', latitude=33.78, longitude=-84.38)
+        self.petition = MoviePetition.objects.create(movie_name='Heat', description='Classic', created_by=self.user)
+        MoviePurchase.objects.create(movie=self.movie, user=self.user, region=self.region, quantity=2)
+        Review.objects.create(movie=self.movie, user=self.user, comment='Great')
+        Order.objects.create(user=self.user, total=12)
+        self.client.force_login(self.user)
+
+    def explain(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return ' | '.join(row[-1] for row in cursor.fetchall())
+
+    def view_plans(self, url, table):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [
+            self.explain(query['sql'])
+            for query in queries
+            if query['sql'].startswith('SELECT') and f'FROM "{table}"' in query['sql']
+        ]
+
+    def assertIndexed(self, plan, table, ordered_by_index=True):
+        # "SCAN table" without an index is a full table scan; "SCAN table USING INDEX" walks an index in order
+        self.assertIsNone(re.search(rf'SCAN {table}(?! USING)', plan), plan)
+        if ordered_by_index:
+            self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+
+    def assertViewIndexed(self, url, table, ordered_by_index=True):
+        plans = self.view_plans(url, table)
+        self.assertTrue(plans, f'{url} did not query {table}')
+        for plan in plans:
+            self.assertIndexed(plan, table, ordered_by_index)
+
+    def assertQuerysetIndexed(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        self.assertIndexed(self.explain(sql, params), queryset.model._meta.db_table)
+
+    def test_catalog(self):
+        self.assertViewIndexed(reverse('movies.index'), 'movies_movie')
+
+    def test_movie_reviews(self):
+        self.assertViewIndexed(reverse('movies.show', kwargs={'id': self.movie.id}), 'movies_review')
+
+    def test_petition_list(self):
+        self.assertViewIndexed(reverse('movies.petition_list'), 'movies_moviepetition')
+
+    def test_popularity_map(self):
+        # The final sort only covers the top rows per region kept by the window function
+        self.assertViewIndexed(reverse('movies.local_popularity_map'), 'movies_regionmoviepopularity', ordered_by_index=False)
+
+    def test_region_detail(self):
+        self.assertViewIndexed(reverse('movies.region_detail', kwargs={'region_id': self.region.id}), 'movies_regionmoviepopularity')
+
+    def test_order_history(self):
+        self.assertViewIndexed(reverse('accounts.orders'), 'cart_order')
+
+    def test_region_purchase_history(self):
+        self.assertQuerysetIndexed(
+            MoviePurchase.objects.filter(region=self.region, movie=self.movie).order_by('-purchase_date')
+        )
+
+    def test_petition_vote_tally(self):
+        self.assertQuerysetIndexed(PetitionVote.objects.filter(petition=self.petition, vote_type='yes'))
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie = Movie.objects.create(name='Inception', price=12, description='Dreams', image='movie_images/inception.jpg', amount_left=5)
+        self.url = reverse('movies.show', kwargs={'id': self.movie.id})
+        self.client.get(self.url)
+
+    def test_anonymous_hits_skip_the_database(self):
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(self.url), 'Inception')
+
+    def test_invalidation_from_another_worker(self):
+        # Another process only shares the tag store, never this process's page cache
+        caches['page_tags'].set(TAG_VERSION_KEY.format(f'movie:{self.movie.id}'), 'bumped-elsewhere')
+        Movie.objects.filter(id=self.movie.id).update(name='Interstellar')
+        self.assertContains(self.client.get(self.url), 'Interstellar')
+
+    def test_invalidate_pages_and_all_pages(self):
+        Movie.objects.filter(id=self.movie.id).update(name='Interstellar')
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_pages(f'movie:{self.movie.id}')
+        self.assertContains(self.client.get(self.url), 'Interstellar')
+        Movie.objects.filter(id=self.movie.id).update(name='Memento')
+        invalidate_all_pages()
+        self.assertContains(self.client.get(self.url), 'Memento')
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        Movie.objects.create(name='The Matrix', price=10, description='A hacker learns the truth about reality.', image='movie_images/matrix.jpg', amount_left=5)
+        Movie.objects.create(name='Inception', price=12, description='A thief enters dreams, a matrix of shared levels.', image='movie_images/inception.jpg', amount_left=5)
+        Movie.objects.create(name='Matrix Sold Out', price=9, description='Gone.', image='movie_images/gone.jpg', amount_left=0)
+
+    def names(self, results):
+        names = dict(Movie.objects.values_list('id', 'name'))
+        return [names[movie_id] for movie_id, snippet in results]
+
+    def check_ranking_and_snippets(self):
+        results = search_movies('matri')
+        # Name matches outrank description matches
+        self.assertEqual(set(self.names(results)[:2]), {'The Matrix', 'Matrix Sold Out'})
+        self.assertEqual(self.names(results)[2], 'Inception')
+        self.assertEqual(self.names(search_movies('matrix', in_stock=True)), ['The Matrix', 'Inception'])
+        self.assertIn('<mark>matrix</mark>', results[2][1])
+        self.assertEqual(search_movies('dreams levels'), search_movies('levels dreams'))
+        self.assertEqual(search_movies('"<script>'), [])
+
+    def test_fts(self):
+        self.check_ranking_and_snippets()
+
+    def test_python_fallback(self):
+        with mock.patch('movies.search.fts_available', return_value=False):
+            self.check_ranking_and_snippets()
+            # Index changes made anywhere reach this process through the DataVersion row
+            Movie.objects.create(name='Matrix Reloaded', price=10, description='More of it.', image='movie_images/reloaded.jpg', amount_left=5)
+            self.assertIn('Matrix Reloaded', self.names(search_movies('matrix')))
+
+    def test_pages_only_hold_movies_in_stock(self):
+        Movie.objects.bulk_create([
+            Movie(name=f'Matrix {i}', price=5, description='Sequel', image='movie_images/sequel.jpg', amount_left=i % 2)
+            for i in range(2 * SEARCH_PAGE_SIZE)
+        ])
+        rebuild_search_index()
+        first = self.client.get(reverse('movies.index'), {'search': 'matrix'}).context['template_data']
+        self.assertEqual(len(first['movies']), SEARCH_PAGE_SIZE)
+        self.assertTrue(first['has_next_page'])
+        second = self.client.get(reverse('movies.index'), {'search': 'matrix', 'page': 2}).context['template_data']
+        self.assertEqual(len(second['movies']), 2)
+        self.assertFalse(second['has_next_page'])
+        self.assertTrue(all(movie.amount_left > 0 for movie in first['movies'] + second['movies']))
+
+class ExportStreamingTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create(username='operator', is_staff=True)
+        movie = Movie.objects.create(name='Inception', price=12, description='Dreams', image='movie_images/inception.jpg', amount_left=5)
+        for rating in range(1, 6):
+            MovieRating.objects.create(movie=movie, user=User.objects.create(username=f'rater{rating}'), rating=rating)
+        self.url = reverse('movies.export_data', kwargs={'table': 'ratings'})
+
+    def test_wsgi_streams_a_sync_iterator(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url, {'format': 'jsonl'})
+        self.assertFalse(response.is_async)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 5)
+
+    async def test_asgi_streams_an_async_iterator(self):
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.get(self.url)
+        self.assertTrue(response.is_async)
+        lines = b''.join([chunk async for chunk in response.streaming_content]).decode().splitlines()
+        self.assertEqual(lines[0], 'id,user_id,movie_id,rating,rated_at')
+        self.assertEqual(len(lines), 6)
+
+class SampleDataTests(TestCase):
+    def test_generated_dates_are_kept(self):
+        call_command('populate_sample_data', movies=5, users=5, purchases=20, ratings=20, reviews=20, days=30, seed=1, stdout=StringIO())
+        self.assertEqual(MoviePurchase.objects.count(), 20)
+        for model, field in [(MoviePurchase, 'purchase_date'), (MovieRating, 'rated_at'), (Review, 'date')]:
+            self.assertGreater(model.objects.values(field).distinct().count(), 1)
+        self.assertLess(MoviePurchase.objects.earliest('purchase_date').purchase_date, timezone.now() - timedelta(days=1))
+
+    def test_purchases_are_skipped_without_regions(self):
+        output = StringIO()
+        call_command('populate_sample_data', regions=0, movies=2, users=2, purchases=10, seed=1, stdout=output)
+        self.assertIn('No regions found', output.getvalue())
+        self.assertFalse(MoviePurchase.objects.exists())
+
+class ReviewCursorTests(TestCase):
+    def setUp(self):
+        self.movie = Movie.objects.create(name='Inception', price=12, description='Dreams', image='movie_images/inception.jpg', amount_left=5)
+        self.url = reverse('movies.review_page_api', kwargs={'id': self.movie.id})
+        same_moment = timezone.now() - timedelta(days=1)
+        for i in range(5):
+            user = User.objects.create(username=f'reviewer{i}')
+            # Three reviews share a date, so pages must break ties on id
+            date = same_moment if i < 3 else timezone.now() - timedelta(hours=i)
+            Review.objects.create(movie=self.movie, user=user, comment=f'Review {i}', date=date)
+
+    def test_cursor_round_trip(self):
+        review = Review.objects.first()
+        self.assertEqual(decode_date_cursor(encode_date_cursor(review)), (review.date, review.id))
+
+    def test_pages_cover_every_review_once_despite_ties(self):
+        seen, cursor = [], None
+        while True:
+            reviews, cursor = date_keyset_page(Review.objects.filter(movie=self.movie), cursor, 2)
+            seen += [review.id for review in reviews]
+            if cursor is None:
+                break
+        expected = list(Review.objects.order_by('-date', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_api_pages(self):
+        first = self.client.get(self.url).json()
+        self.assertEqual(len(first['reviews']), 5)
+        self.assertIsNone(first['next_cursor'])
+        user = User.objects.get(username='reviewer0')
+        Review.objects.bulk_create([Review(movie=self.movie, user=user, comment=f'More {i}') for i in range(REVIEWS_PAGE_SIZE)])
+        page = self.client.get(self.url).json()
+        rest = self.client.get(self.url, {'cursor': page['next_cursor']}).json()
+        self.assertEqual(len(page['reviews']), REVIEWS_PAGE_SIZE)
+        self.assertEqual(len(rest['reviews']), 5)
+        self.assertFalse({review['id'] for review in page['reviews']} & {review['id'] for review in rest['reviews']})
+        self.assertIsNone(rest['next_cursor'])
+
+    def test_malformed_or_tampered_cursors_are_rejected(self):
+        encode = lambda text: base64.urlsafe_b64encode(text.encode()).decode()
+        cursors = [
+            'not a cursor', '%%%', 'é', encode('yesterday|1'), encode('2024-01-01T00:00:00+00:00'),
+            encode('2024-01-01T00:00:00|1'), encode('2024-01-01T00:00:00+00:00|' + '9' * 30), encode('2024-01-01T00:00:00+00:00|x|y'),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(self.url, {'cursor': cursor}).status_code, 400)
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        self.inception = Movie.objects.create(name='Inception', price=12, description='Dreams', image='movie_images/inception.jpg', amount_left=5)
+        self.memento = Movie.objects.create(name='Memento', price=10, description='Memory', image='movie_images/memento.jpg', amount_left=5)
+        self.user = User.objects.create(username='critic')
+
+    def aggregates(self, movie):
+        movie.refresh_from_db()
+        return movie.rating_sum, movie.rating_count
+
+    def test_rating_through_the_view(self):
+        self.client.force_login(self.user)
+        url = reverse('movies.rate_movie', kwargs={'movie_id': self.inception.id})
+        self.client.post(url, {'rating': 4})
+        self.assertEqual(self.aggregates(self.inception), (4, 1))
+        self.client.post(url, {'rating': 2})
+        self.assertEqual(self.aggregates(self.inception), (2, 1))
+
+    def test_edits_and_deletes_outside_the_view(self):
+        other = User.objects.create(username='other')
+        rating = MovieRating.objects.create(movie=self.inception, user=self.user, rating=5)
+        MovieRating.objects.create(movie=self.inception, user=other, rating=3)
+        self.assertEqual(self.aggregates(self.inception), (8, 2))
+        rating.movie = self.memento
+        rating.save()
+        self.assertEqual((self.aggregates(self.inception), self.aggregates(self.memento)), ((3, 1), (5, 1)))
+        rating.delete()
+        self.assertEqual(self.aggregates(self.memento), (0, 0))
+        # Deleting a user cascades to their ratings
+        other.delete()
+        self.assertEqual(self.aggregates(self.inception), (0, 0))
+
+class PetitionVoteTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='voter')
+        self.petition = MoviePetition.objects.create(movie_name='Heat', description='A classic', created_by=self.user)
+        self.other_petition = MoviePetition.objects.create(movie_name='Ronin', description='Car chases', created_by=self.user)
+
+    def tallies(self, petition):
+        petition.refresh_from_db()
+        return petition.yes_votes, petition.no_votes
+
+    def test_vote_flips_through_the_view(self):
+        self.client.force_login(self.user)
+        url = reverse('movies.vote_petition', kwargs={'petition_id': self.petition.id})
+        self.client.post(url, {'vote_type': 'yes'})
+        self.assertEqual(self.tallies(self.petition), (1, 0))
+        self.client.post(url, {'vote_type': 'no'})
+        self.assertEqual(self.tallies(self.petition), (0, 1))
+        self.client.post(url, {'vote_type': 'no'})
+        self.assertEqual(self.tallies(self.petition), (0, 1))
+        self.assertEqual(PetitionVote.objects.count(), 1)
+
+    def test_edits_and_deletes_outside_the_view(self):
+        other = User.objects.create(username='other')
+        vote = PetitionVote.objects.create(petition=self.petition, user=self.user, vote_type='yes')
+        PetitionVote.objects.create(petition=self.petition, user=other, vote_type='no')
+        self.assertEqual(self.tallies(self.petition), (1, 1))
+        vote.petition = self.other_petition
+        vote.vote_type = 'no'
+        vote.save()
+        self.assertEqual((self.tallies(self.petition), self.tallies(self.other_petition)), ((0, 1), (0, 1)))
+        vote.delete()
+        self.assertEqual(self.tallies(self.other_petition), (0, 0))
+        # Deleting a user cascades to their votes
+        other.delete()
+        self.assertEqual(self.tallies(self.petition), (0, 0))
+
+    def test_reconcile_repairs_drifted_counters(self):
+        PetitionVote.objects.create(petition=self.petition, user=self.user, vote_type='yes')
+        MoviePetition.objects.filter(id=self.petition.id).update(yes_votes=4, no_votes=2)
+        out = StringIO()
+        call_command('reconcile_petition_votes', stdout=out)
+        self.assertIn('1 petitions disagree', out.getvalue())
+        self.assertEqual(self.tallies(self.petition), (4, 2))
+        call_command('reconcile_petition_votes', '--repair', stdout=out)
+        self.assertIn('Repaired 1 petitions', out.getvalue())
+        self.assertEqual((self.tallies(self.petition), self.tallies(self.other_petition)), ((1, 0), (0, 0)))
+
+
+class BenchmarkCoverageTests(TestCase):
+    def test_every_named_route_is_benchmarked(self):
+        self.assertIn('metrics', named_routes())
+        self.assertEqual(named_routes() - {url_name(route) for route in ROUTES}, set())
+
+    def test_gate_scales_with_the_machine_and_only_fails_on_p50(self):
+        def route(p50, p90, queries=3, peak=100):
+            return {'p50_ms': p50, 'p90_ms': p90, 'p50_relative': p50, 'p90_relative': p90, 'queries': queries, 'peak_kib': peak}
+
+        names = ['a', 'b', 'c', 'd', 'e']
+        baseline = {'routes': {name: route(10, 12) for name in names}}
+        options = {'latency_tolerance': 0.5, 'memory_tolerance': 0.25}
+        compare = BenchmarkCommand(stdout=StringIO()).compare
+        # A machine twice as slow, with a noisy reference route and p90 outliers
+        results = {'reference_ms': 0.5, 'routes': {name: route(20, 24) for name in names}}
+        results['routes']['a'] = route(20, 90)
+        self.assertEqual(compare(baseline, results, options), [])
+        results['routes']['b'] = route(45, 50, queries=4)
+        results['routes']['f'] = route(1, 1)
+        self.assertEqual(
+            [regression.split(':')[0] for regression in compare(baseline, results, options)], ['b', 'b', 'f'],
+        )
+
+    def test_every_benchmarked_route_has_a_baseline(self):
+        baseline = json.loads(DEFAULT_BASELINE.read_text())
+        self.assertEqual(set(ROUTES) - baseline['routes'].keys(), set())
+        self.assertEqual(baseline['reference_route'], REFERENCE_ROUTE)
+        for name, entry in baseline['routes'].items():
+            with self.subTest(route=name):
+                self.assertGreater(entry['p50_relative'], 0)
+                self.assertIn('queries', entry)
+
+
+@override_settings(METRICS_SAMPLE_RATE=1)
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+        self.movie = Movie.objects.create(name='Inception', price=12, description='Dreams', image='movie_images/inception.jpg', amount_left=5)
+        self.staff = User.objects.create(username='operator', is_staff=True)
+
+    def test_server_timing_header_is_staff_only(self):
+        url = reverse('movies.show', kwargs={'id': self.movie.id})
+        self.assertNotIn('Server-Timing', self.client.get(url))
+        self.client.force_login(self.staff)
+        response = self.client.get(url)
+        self.assertRegex(response['Server-Timing'], r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+$')
+        self.assertNotRegex(response['Server-Timing'], r'tpl;dur=0\.0$')
+
+    async def test_server_timing_header_on_async_views(self):
+        self.assertNotIn('Server-Timing', await self.async_client.get(reverse('movies.index')))
+        await self.async_client.aforce_login(self.staff)
+        self.assertIn('Server-Timing', await self.async_client.get(reverse('movies.index')))
+
+    def test_metrics_are_staff_only(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_metrics_report_routes_in_prometheus_format(self):
+        self.client.get(reverse('movies.show', kwargs={'id': self.movie.id}))
+        self.client.force_login(self.staff)
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('moviesstore_requests_total{route="movies.show"} 1', body)
+        self.assertIn('moviesstore_sql_queries{route="movies.show",quantile="0.5"}', body)
+        self.assertIn('# TYPE moviesstore_request_duration_seconds summary', body)
+
+
+# The replica alias is only listed in READ_REPLICAS, not DATABASES, so a read routed to it fails the
+# test; TestCase is avoided because its transaction would send every read to the primary anyway
+@override_settings(READ_REPLICAS=['replica_1'])
+class ReplicaRoutingTests(TransactionTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.movie = Movie.objects.create(name='Inception', price=12, description='Dreams', image='movie_images/inception.jpg', amount_left=5)
+
+    def test_catalog_reads_go_to_a_replica(self):
+        self.assertEqual(self.router.db_for_read(Movie), 'replica_1')
+        self.assertEqual(self.router.db_for_write(Movie), 'default')
+
+    def test_pinned_and_atomic_reads_use_the_primary(self):
+        with transaction.atomic():
+            self.assertEqual(self.router.db_for_read(Movie), 'default')
+        token = primary_pinned.set(True)
+        try:
+            self.assertEqual(self.router.db_for_read(Movie), 'default')
+        finally:
+            primary_pinned.reset(token)
+
+    def test_other_models_never_use_a_replica(self):
+        for model in apps.get_models():
+            if model._meta.label_lower not in REPLICA_MODELS:
+                with self.subTest(model=model._meta.label):
+                    self.assertEqual(self.router.db_for_read(model), 'default')
+        self.assertEqual(self.router.db_for_read(MovieRating), 'default')
+        self.assertEqual(self.router.db_for_read(User), 'default')
+
+    def test_writes_pin_the_user_to_the_primary(self):
+        user = User.objects.create(username='critic')
+        self.client.force_login(user)
+        self.assertNotIn(PIN_COOKIE, self.client.get(reverse('home.about')).cookies)
+        response = self.client.post(reverse('movies.rate_movie', kwargs={'movie_id': self.movie.id}), {'rating': 4})
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+        # With the pin every read of the next request stays on the primary
+        self.assertEqual(self.client.get(reverse('movies.show', kwargs={'id': self.movie.id})).status_code, 200)
+
+
+class PosterVariantTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        shutil.copytree(Path(settings.MEDIA_ROOT) / 'movie_images', Path(self.media_root) / 'movie_images')
+        media_override = override_settings(MEDIA_ROOT=self.media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+    def test_variants_are_generated_on_first_use(self):
+        movie = Movie(name='Inception', image='movie_images/inception.jpg')
+        self.assertEqual(poster_url(movie.image, 320, 'webp'), '/media/movie_images/variants/inception-jpg-320w.webp')
+        self.assertIn('/media/movie_images/variants/inception-jpg-640w.jpg 640w', poster_srcset(movie.image))
+        variant = Path(self.media_root) / 'movie_images' / 'variants' / 'inception-jpg-160w.webp'
+        self.assertEqual(Image.open(variant).width, 160)
+
+    def test_picture_sources_check_the_variants_once(self):
+        movie = Movie(name='Inception', image='movie_images/inception.jpg')
+        poster_url(movie.image, 320)
+        with mock.patch.object(cache, 'get', wraps=cache.get) as cache_get:
+            sources = poster_sources(movie.image, 320)
+        cache_get.assert_called_once()
+        self.assertEqual(sources['src'], '/media/movie_images/variants/inception-jpg-320w.jpg')
+        self.assertEqual(sources['webp'], poster_srcset(movie.image, 'webp'))
+        self.assertEqual(sources['jpeg'], poster_srcset(movie.image))
+
+    def test_same_stem_with_another_extension_gets_its_own_variants(self):
+        Image.new('RGB', (400, 600), 'red').save(Path(self.media_root) / 'movie_images' / 'inception.png')
+        jpeg, png = Movie(image='movie_images/inception.jpg'), Movie(image='movie_images/inception.png')
+        self.assertNotEqual(poster_url(jpeg.image, 320, 'webp'), poster_url(png.image, 320, 'webp'))
+        variant = Path(self.media_root) / 'movie_images' / 'variants' / 'inception-png-320w.jpg'
+        self.assertEqual(Image.open(variant).size, (320, 480))
+
+    def test_missing_original_falls_back_to_the_original_url(self):
+        movie = Movie(name='Missing', image='movie_images/missing.jpg')
+        # Failures are only remembered for a while, so an original uploaded later is picked up
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            self.assertEqual(poster_url(movie.image, 320), '/media/movie_images/missing.jpg')
+        cache_set.assert_called_once_with(variants_cache_key(movie.image.name), False, VARIANT_RETRY_SECONDS)
+        self.assertEqual(poster_srcset(movie.image), '')
+        self.assertEqual(poster_sources(movie.image, 320), {'src': '/media/movie_images/missing.jpg', 'jpeg': '', 'webp': ''})
+
+
+class AssetServingTests(TestCase):
+    def test_collected_static_files_are_hashed_compressed_and_immutable(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        storages = {**settings.STORAGES, 'staticfiles': {'BACKEND': 'moviesstore.assets.CompressedManifestStaticFilesStorage'}}
+        with override_settings(STATIC_ROOT=static_root, STORAGES=storages):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            hashed_name = json.loads((Path(static_root) / 'staticfiles.json').read_text())['paths']['css/style.css']
+            response = self.client.get(f'/static/{hashed_name}', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        original = (Path(static_root) / hashed_name).read_bytes()
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), original)
+
+    def test_media_supports_range_and_conditional_requests(self):
+        url = '/media/movie_images/inception.jpg'
+        poster = (Path(settings.MEDIA_ROOT) / 'movie_images' / 'inception.jpg').read_bytes()
+        response = self.client.get(url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(poster)}')
+        self.assertEqual(b''.join(response.streaming_content), poster[100:200])
+
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_RANGE=f'bytes={len(poster)}-').status_code, 416)
+
+
+class RegionDataApiTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='buyer')
+        self.movie = Movie.objects.create(name='Inception', price=12, description='Dreams', image='movie_images/inception.jpg', amount_left=5)
+        self.midtown = GeographicRegion.objects.create(name='Midtown Atlanta', latitude=33.78, longitude=-84.38)
+        self.decatur = GeographicRegion.objects.create(name='Decatur', latitude=33.77, longitude=-84.29)
+        MoviePurchase.objects.create(movie=self.movie, user=user, region=self.midtown, quantity=3)
+
+    async def test_batched_regions(self):
+        response = await self.async_client.get(reverse('movies.regions_data_api'), {'ids': f'{self.midtown.id},{self.decatur.id}'})
+        regions = response.json()['regions']
+        self.assertEqual([region['region']['name'] for region in regions], ['Midtown Atlanta', 'Decatur'])
+        self.assertEqual(regions[0]['top_movies'][0]['purchases'], 3)
+        self.assertEqual(regions[1]['top_movies'], [])
+
+    async def test_batched_regions_rejects_bad_ids(self):
+        response = await self.async_client.get(reverse('movies.regions_data_api'), {'ids': 'midtown'})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_single_region(self):
+        response = await self.async_client.get(reverse('movies.region_data_api', kwargs={'region_id': self.midtown.id}))
+        self.assertEqual(response.json()['top_movies'][0]['name'], 'Inception')
+
+    def test_batched_regions_cost_a_fixed_number_of_queries(self):
+        cache.clear()
+        url = reverse('movies.regions_data_api')
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        for i in range(5):
+            GeographicRegion.objects.create(name=f'Region {i}', latitude=34 + i / 10, longitude=-84.3)
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {'limit': 1})
+        self.assertEqual(len(response.json()['regions']), 7)
+
+    def test_bounding_box(self):
+        response = self.client.get(reverse('movies.regions_data_api'), {'bbox': '33.7,-84.4,33.8,-84.35'})
+        self.assertEqual([region['region']['name'] for region in response.json()['regions']], ['Midtown Atlanta'])
+
+    def test_etag_revalidation(self):
+        cache.clear()
+        url = reverse('movies.regions_data_api')
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        MovieRating.objects.create(movie=self.movie, user=User.objects.get(username='buyer'), rating=5)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        # Wiping the shared page cache state, as a restart or another worker would see it, keeps the ETag
+        caches['page_tags'].clear()
+        cache.clear()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+class TrendingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now()
+        self.user = User.objects.create(username='buyer')
+        self.region = GeographicRegion.objects.create(name='Midtown Atlanta', latitude=33.78, longitude=-84.38)
+        self.inception = Movie.objects.create(name='Inception', price=12, description='Dreams', image='movie_images/inception.jpg', amount_left=5)
+        self.memento = Movie.objects.create(name='Memento', price=10, description='Memory', image='movie_images/memento.jpg', amount_left=5)
+
+    def purchase(self, movie, quantity, hours_ago):
+        MoviePurchase.objects.create(
+            movie=movie, user=self.user, region=self.region, quantity=quantity, purchase_date=self.now - timedelta(hours=hours_ago)
+        )
+
+    def purchases(self, window, now=None):
+        movies = trending_by_region(window, limit=None, now=now or self.now).get(self.region.id, [])
+        return [(movie.name, movie.region_purchases) for movie in movies]
+
+    def test_windows_rank_purchases(self):
+        self.purchase(self.inception, 3, hours_ago=5 * 24)
+        self.purchase(self.memento, 2, hours_ago=1)
+        self.purchase(self.memento, 1, hours_ago=40 * 24)
+        rebuild_trends(now=self.now)
+        self.assertEqual(self.purchases('24h'), [('Memento', 2)])
+        self.assertEqual(self.purchases('7d'), [('Inception', 3), ('Memento', 2)])
+        # Recent purchases outweigh more purchases from days ago
+        self.assertEqual(self.purchases(TRENDING), [('Memento', 2), ('Inception', 3)])
+
+    def test_compaction_keeps_window_totals(self):
+        for hours_ago in (1, 20, 30, 47, 60, 100, 24 * 29):
+            self.purchase(self.inception, 1, hours_ago=hours_ago)
+        rebuild_trends(now=self.now)
+        later = self.now + timedelta(days=2)
+        expected = {window: self.purchases(window, now=later) for window in ('24h', '7d', '30d')}
+        rolled, expired = compact_trends(now=later)
+        self.assertGreater(rolled, 0)
+        self.assertEqual(expired, 1)
+        self.assertEqual({window: self.purchases(window, now=later) for window in expected}, expected)
+        self.assertEqual(expected['7d'], [('Inception', 6)])
+        self.assertFalse(RegionMovieTrend.objects.filter(granularity=RegionMovieTrend.HOUR, bucket__lt=(later.timestamp() // 3600) - 72).exists())
+
+    def test_signals_and_window_views(self):
+        purchase = MoviePurchase.objects.create(movie=self.inception, user=self.user, region=self.region, quantity=2)
+        self.assertEqual(self.purchases('24h'), [('Inception', 2)])
+        response = self.client.get(reverse('movies.region_detail', kwargs={'region_id': self.region.id}), {'window': '24h'})
+        self.assertEqual([movie.name for movie in response.context['template_data']['movies']], ['Inception'])
+        self.assertEqual(self.client.get(reverse('movies.local_popularity_map'), {'window': TRENDING}).status_code, 200)
+        purchase.delete()
+        self.assertEqual(self.purchases('24h'), [])
@@ -0,0 +1,180 @@
+import copy
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db import connection, transaction
+from django.db.models import Case, F, FloatField, Q, Sum, Value, When, Window
+from django.db.models.functions import Cast, Mod, Power, RowNumber, TruncHour
+from django.utils import timezone
+from .models import Movie, MoviePurchase, RegionMovieTrend
+from .utils import upsert_counters
+
+# Window name -> length in hours; also the choices offered on the map pages
+TRENDING_WINDOWS = {'24h': 24, '7d': 24 * 7, '30d': 24 * 30}
+TRENDING = 'trending'
+# Hourly buckets older than this are rolled up into daily buckets by compact_trends()
+HOURLY_RETENTION_HOURS = 48
+# Daily buckets older than the longest window are dropped; all-time totals live in RegionMoviePopularity
+DAILY_RETENTION_HOURS = max(TRENDING_WINDOWS.values())
+# A purchase counts half as much towards the trending score after this many hours
+HALF_LIFE_HOURS = 24
+
+
+def hour_bucket(moment):
+    """Hours since the Unix epoch at the start of the hour containing moment"""
+    return int(moment.timestamp()) // 3600
+
+
+def day_bucket(hour):
+    return hour - hour % 24
+
+
+def bucket_key(region_id, movie_id, hour, now_hour):
+    """The bucket a purchase made during hour belongs in, given the current hour.
+
+    Whole days move from hourly to daily buckets, the same days compact_trends() rolls up.
+    """
+    if hour < day_bucket(now_hour - HOURLY_RETENTION_HOURS):
+        return region_id, movie_id, RegionMovieTrend.DAY, day_bucket(hour)
+    return region_id, movie_id, RegionMovieTrend.HOUR, hour
+
+
+def record_purchases_in_trends(purchases, now=None):
+    """Add newly written MoviePurchase rows to their hourly trend buckets"""
+    now_hour = hour_bucket(now or timezone.now())
+    totals = Counter()
+    for purchase in purchases:
+        totals[bucket_key(purchase.region_id, purchase.movie_id, hour_bucket(purchase.purchase_date), now_hour)] += purchase.quantity
+    add_to_buckets(totals)
+
+
+def add_to_buckets(totals):
+    """Increment {(region_id, movie_id, granularity, bucket): quantity}, creating missing buckets"""
+    upsert_counters(
+        RegionMovieTrend, ('region_id', 'movie_id', 'granularity', 'bucket'),
+        {key: {'quantity': quantity} for key, quantity in totals.items()},
+        increments=['quantity'],
+    )
+
+
+def refresh_trend_bucket(region_id, movie_id, purchase_date, now=None):
+    """Recompute the bucket holding purchase_date from MoviePurchase, after an edit or delete"""
+    now_hour = hour_bucket(now or timezone.now())
+    _, _, granularity, bucket = bucket_key(region_id, movie_id, hour_bucket(purchase_date), now_hour)
+    if bucket < day_bucket(now_hour - DAILY_RETENTION_HOURS):
+        return
+    pair = RegionMovieTrend.objects.filter(region_id=region_id, movie_id=movie_id)
+    if granularity == RegionMovieTrend.DAY:
+        # The whole day is recounted, so drop any of its hours compact_trends() has not rolled up yet
+        pair.filter(granularity=RegionMovieTrend.HOUR, bucket__gte=bucket, bucket__lt=bucket + 24).delete()
+    start = datetime.fromtimestamp(bucket * 3600, tz=dt_timezone.utc)
+    length = timedelta(days=1) if granularity == RegionMovieTrend.DAY else timedelta(hours=1)
+    total = MoviePurchase.objects.filter(
+        region_id=region_id, movie_id=movie_id, purchase_date__gte=start, purchase_date__lt=start + length
+    ).aggregate(total=Sum('quantity'))['total']
+    if total:
+        RegionMovieTrend.objects.update_or_create(
+            region_id=region_id, movie_id=movie_id, granularity=granularity, bucket=bucket, defaults={'quantity': total}
+        )
+    else:
+        pair.filter(granularity=granularity, bucket=bucket).delete()
+
+
+def compact_trends(now=None):
+    """Roll hourly buckets of finished days past the hourly retention into daily buckets and drop expired days.
+
+    Returns (hourly buckets rolled up, daily buckets dropped).
+    """
+    now_hour = hour_bucket(now or timezone.now())
+    with transaction.atomic():
+        old_hours = RegionMovieTrend.objects.filter(
+            granularity=RegionMovieTrend.HOUR, bucket__lt=day_bucket(now_hour - HOURLY_RETENTION_HOURS)
+        )
+        days = old_hours.values('region_id', 'movie_id').annotate(
+            day=F('bucket') - Mod('bucket', 24), total=Sum('quantity')
+        ).order_by()
+        add_to_buckets(Counter({
+            (row['region_id'], row['movie_id'], RegionMovieTrend.DAY, row['day']): row['total']
+            for row in days
+        }))
+        rolled, _ = old_hours.delete()
+        expired, _ = RegionMovieTrend.objects.filter(
+            granularity=RegionMovieTrend.DAY, bucket__lt=day_bucket(now_hour - DAILY_RETENTION_HOURS)
+        ).delete()
+    return rolled, expired
+
+
+def rebuild_trends(now=None, batch_size=1000):
+    """Replace every trend bucket with fresh counts from the retained span of MoviePurchase"""
+    now = now or timezone.now()
+    now_hour = hour_bucket(now)
+    hours = MoviePurchase.objects.filter(
+        purchase_date__gte=now - timedelta(hours=DAILY_RETENTION_HOURS + 24)
+    ).values('region_id', 'movie_id', hour=TruncHour('purchase_date')).annotate(total=Sum('quantity')).order_by()
+    totals = Counter()
+    for row in hours.iterator(chunk_size=batch_size):
+        totals[bucket_key(row['region_id'], row['movie_id'], hour_bucket(row['hour']), now_hour)] += row['total']
+    RegionMovieTrend.objects.all().delete()
+    return len(RegionMovieTrend.objects.bulk_create(
+        (
+            RegionMovieTrend(region_id=region_id, movie_id=movie_id, granularity=granularity, bucket=bucket, quantity=quantity)
+            for (region_id, movie_id, granularity, bucket), quantity in totals.items()
+            if bucket >= day_bucket(now_hour - DAILY_RETENTION_HOURS)
+        ),
+        batch_size=batch_size,
+    ))
+
+
+def trending_by_region(window, limit=5, region_ids=None, now=None):
+    """Map region ids to their top movies over a window from TRENDING_WINDOWS, or TRENDING.
+
+    Movies carry region_purchases (purchases in the window) and trend_score
+    (purchases decayed with HALF_LIFE_HOURS). Windows rank by purchases, TRENDING
+    ranks by score over the retained buckets. Costs two queries, ranking every
+    region at once with ROW_NUMBER() where the backend supports it. Windows longer
+    than HOURLY_RETENTION_HOURS start at a day boundary.
+    """
+    now_hour = hour_bucket(now or timezone.now())
+    start = now_hour - (TRENDING_WINDOWS[window] if window != TRENDING else DAILY_RETENTION_HOURS) + 1
+    buckets = RegionMovieTrend.objects.filter(
+        Q(granularity=RegionMovieTrend.HOUR, bucket__gte=start)
+        | Q(granularity=RegionMovieTrend.DAY, bucket__gte=day_bucket(start))
+    )
+    if region_ids is not None:
+        buckets = buckets.filter(region_id__in=region_ids)
+
+    # Daily buckets are weighted from their middle
+    age = Value(float(now_hour)) - Cast('bucket', FloatField()) - Case(
+        When(granularity=RegionMovieTrend.DAY, then=Value(12.0)), default=Value(0.0), output_field=FloatField()
+    )
+    ranking = ['-score', 'movie_id'] if window == TRENDING else ['-purchases', '-score', 'movie_id']
+    rows = buckets.values('region_id', 'movie_id').annotate(
+        purchases=Sum('quantity'),
+        score=Sum(Cast('quantity', FloatField()) * Power(Value(0.5), age / Value(float(HALF_LIFE_HOURS)))),
+    )
+    if limit is not None and connection.features.supports_over_clause:
+        rows = rows.annotate(
+            position=Window(
+                RowNumber(),
+                partition_by=F('region_id'),
+                order_by=[F(name[1:]).desc() if name.startswith('-') else F(name).asc() for name in ranking],
+            )
+        ).filter(position__lte=limit)
+    rows = rows.order_by('region_id', *ranking)
+
+    ranked = {}
+    for row in rows:
+        region_rows = ranked.setdefault(row['region_id'], [])
+        if limit is None or len(region_rows) < limit:
+            region_rows.append(row)
+    movies = Movie.objects.in_bulk({row['movie_id'] for region_rows in ranked.values() for row in region_rows})
+
+    result = {}
+    for region_id, region_rows in ranked.items():
+        result[region_id] = []
+        for row in region_rows:
+            # Copies, since the same movie can rank in several regions
+            movie = copy.copy(movies[row['movie_id']])
+            movie.region_purchases = row['purchases']
+            movie.trend_score = round(row['score'], 2)
+            result[region_id].append(movie)
+    return result
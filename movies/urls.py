@@ -7,6 +7,7 @@ urlpatterns = [
     path('<int:id>/review/create/', views.create_review, name='movies.create_review'),
     path('<int:id>/review/<int:review_id>/edit/', views.edit_review, name='movies.edit_review'),
     path('<int:id>/review/<int:review_id>/delete/', views.delete_review, name='movies.delete_review'),
+    path('api/<int:id>/reviews/', views.review_page_api, name='movies.review_page_api'),
     # Rating URLs
     path('<int:movie_id>/rate/', views.rate_movie, name='movies.rate_movie'),
     # Petition URLs
@@ -18,4 +19,7 @@ urlpatterns = [
     path('local-popularity/', views.local_popularity_map, name='movies.local_popularity_map'),
     path('region/<int:region_id>/', views.region_detail, name='movies.region_detail'),
     path('api/region/<int:region_id>/', views.region_data_api, name='movies.region_data_api'),
+    path('api/regions/', views.regions_data_api, name='movies.regions_data_api'),
+    # Staff exports
+    path('export/<str:table>/', views.export_data, name='movies.export_data'),
 ]
\ No newline at end of file
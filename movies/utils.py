@@ -0,0 +1,284 @@
+import base64
+import binascii
+import math
+from datetime import datetime
+from functools import reduce
+from operator import or_
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, Count, F, Max, OuterRef, Q, Subquery, Sum, Value, When, Window
+from django.db.models.functions import Coalesce, Greatest, RowNumber
+from .models import DataVersion, GeographicRegion, Movie, MoviePetition, MovieRating, MoviePurchase, PetitionVote, RegionMoviePopularity, Review
+from .page_cache import bump_data_versions
+
+# Georgia Tech, where the popularity map is centered
+STORE_LOCATION = (33.7756, -84.3963)
+REGION_CENTROIDS_CACHE_KEY = 'movies:region_centroids:{}'
+# DataVersion row bumped with every region change, so each process knows when its cached centroids are stale
+REGIONS_VERSION = 'regions'
+USER_REGION_CACHE_KEY = 'movies:user_region:{}'
+USER_REGION_CACHE_TIMEOUT = 60 * 60 * 24
+REVIEWS_PAGE_SIZE = 20
+
+
+def apply_rating_delta(movie_id, sum_delta, count_delta):
+    """Shift the stored rating aggregates of a movie without reading them first"""
+    Movie.objects.filter(id=movie_id).update(
+        rating_sum=F('rating_sum') + sum_delta,
+        rating_count=F('rating_count') + count_delta,
+    )
+
+
+def rebuild_rating_aggregates():
+    """Recompute rating_sum and rating_count for every movie from MovieRating"""
+    per_movie = MovieRating.objects.filter(movie=OuterRef('pk')).order_by().values('movie')
+    return Movie.objects.update(
+        rating_sum=Coalesce(Subquery(per_movie.annotate(total=Sum('rating')).values('total')), Value(0)),
+        rating_count=Coalesce(Subquery(per_movie.annotate(total=Count('id')).values('total')), Value(0)),
+    )
+
+
+def apply_vote_change(petition_id, old_vote_type, new_vote_type):
+    """Move a petition's stored vote tallies from old_vote_type (or None) to new_vote_type (or None)"""
+    if old_vote_type == new_vote_type:
+        return
+    changes = {}
+    if old_vote_type:
+        changes[f'{old_vote_type}_votes'] = F(f'{old_vote_type}_votes') - 1
+    if new_vote_type:
+        changes[f'{new_vote_type}_votes'] = F(f'{new_vote_type}_votes') + 1
+    if changes:
+        MoviePetition.objects.filter(id=petition_id).update(**changes)
+
+
+def petition_vote_tallies():
+    """Return {petition_id: (yes, no)} counted from PetitionVote"""
+    tallies = PetitionVote.objects.values('petition_id').annotate(
+        yes=Count('id', filter=Q(vote_type='yes')),
+        no=Count('id', filter=Q(vote_type='no')),
+    ).order_by()
+    return {row['petition_id']: (row['yes'], row['no']) for row in tallies}
+
+
+def record_purchases_in_rollup(purchases):
+    """Add newly written MoviePurchase rows to the RegionMoviePopularity rollup"""
+    totals = {}
+    for purchase in purchases:
+        row = totals.setdefault(
+            (purchase.region_id, purchase.movie_id), {'total_quantity': 0, 'last_purchased_at': purchase.purchase_date}
+        )
+        row['total_quantity'] += purchase.quantity
+        row['last_purchased_at'] = max(row['last_purchased_at'], purchase.purchase_date)
+    upsert_counters(
+        RegionMoviePopularity, ('region_id', 'movie_id'), totals,
+        increments=['total_quantity'], maxima=['last_purchased_at'],
+    )
+
+
+def upsert_counters(model, key_fields, rows, increments, maxima=()):
+    """Fold {key: {field: value}} into counter rows of model identified by key_fields, creating missing rows.
+
+    increments are added to the stored values, maxima keep the greater of the
+    stored and the new value. Costs at most three queries per batch: find the
+    existing rows, update them in one UPDATE and bulk insert the rest.
+    """
+    if not rows:
+        return
+    existing = set(_counter_rows(model, key_fields, rows).values_list(*key_fields))
+    _increment_counters(model, key_fields, {key: rows[key] for key in existing}, increments, maxima)
+    missing = {key: values for key, values in rows.items() if key not in existing}
+    if not missing:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create([model(**dict(zip(key_fields, key)), **values) for key, values in missing.items()])
+    except IntegrityError:
+        # Another writer created some of the rows first, fall back to one row at a time
+        for key, values in missing.items():
+            if _increment_counters(model, key_fields, {key: values}, increments, maxima):
+                continue
+            model.objects.create(**dict(zip(key_fields, key)), **values)
+
+
+def _counter_rows(model, key_fields, keys):
+    return model.objects.filter(reduce(or_, (Q(**dict(zip(key_fields, key))) for key in keys)))
+
+
+def _increment_counters(model, key_fields, rows, increments, maxima):
+    if not rows:
+        return 0
+
+    def per_row(field):
+        return [When(**dict(zip(key_fields, key)), then=Value(values[field])) for key, values in rows.items()]
+
+    changes = {}
+    for field in increments:
+        output_field = model._meta.get_field(field).__class__()
+        changes[field] = F(field) + Case(*per_row(field), default=Value(0), output_field=output_field)
+    for field in maxima:
+        output_field = model._meta.get_field(field).__class__()
+        changes[field] = Greatest(F(field), Case(*per_row(field), output_field=output_field))
+    return _counter_rows(model, key_fields, rows).update(**changes)
+
+
+def refresh_region_popularity(region_id, movie_id):
+    """Recompute a single (region, movie) rollup row from its purchases"""
+    totals = MoviePurchase.objects.filter(region_id=region_id, movie_id=movie_id).aggregate(
+        total=Sum('quantity'), last=Max('purchase_date')
+    )
+    if totals['total']:
+        RegionMoviePopularity.objects.update_or_create(
+            region_id=region_id,
+            movie_id=movie_id,
+            defaults={'total_quantity': totals['total'], 'last_purchased_at': totals['last']},
+        )
+    else:
+        RegionMoviePopularity.objects.filter(region_id=region_id, movie_id=movie_id).delete()
+
+
+def rebuild_region_popularity(batch_size=1000):
+    """Replace the whole RegionMoviePopularity rollup with fresh totals from MoviePurchase"""
+    grouped = MoviePurchase.objects.values('region_id', 'movie_id').annotate(
+        total=Sum('quantity'), last=Max('purchase_date')
+    ).filter(total__gt=0).order_by()
+    RegionMoviePopularity.objects.all().delete()
+    return len(RegionMoviePopularity.objects.bulk_create(
+        (
+            RegionMoviePopularity(
+                region_id=row['region_id'],
+                movie_id=row['movie_id'],
+                total_quantity=row['total'],
+                last_purchased_at=row['last'],
+            )
+            for row in grouped.iterator(chunk_size=batch_size)
+        ),
+        batch_size=batch_size,
+    ))
+
+
+def top_movies_by_region(limit=5, region_ids=None):
+    """Map region ids to their best selling movies, each with a region_purchases attribute.
+
+    Ranks every region in one query against the RegionMoviePopularity rollup
+    (ROW_NUMBER() where the backend supports it), independent of the number of regions.
+    """
+    return _group_top_movies(_top_movies_rollup(limit, region_ids), limit)
+
+
+async def atop_movies_by_region(limit=5, region_ids=None):
+    """Async version of top_movies_by_region for async views"""
+    return _group_top_movies([entry async for entry in _top_movies_rollup(limit, region_ids)], limit)
+
+
+def _top_movies_rollup(limit, region_ids):
+    rollup = RegionMoviePopularity.objects.filter(total_quantity__gt=0)
+    if region_ids is not None:
+        rollup = rollup.filter(region_id__in=region_ids)
+
+    if connection.features.supports_over_clause:
+        rollup = rollup.annotate(
+            position=Window(
+                RowNumber(),
+                partition_by=F('region_id'),
+                order_by=[F('total_quantity').desc(), F('movie_id').asc()],
+            )
+        ).filter(position__lte=limit)
+    return rollup.select_related('movie').order_by('region_id', '-total_quantity', 'movie_id')
+
+
+def _group_top_movies(entries, limit):
+    result = {}
+    for entry in entries:
+        region_movies = result.setdefault(entry.region_id, [])
+        if len(region_movies) < limit:
+            region_movies.append(with_region_purchases(entry))
+    return result
+
+
+def with_region_purchases(entry):
+    """Return the rollup entry's movie annotated with region_purchases for the templates"""
+    movie = entry.movie
+    movie.region_purchases = entry.total_quantity
+    return movie
+
+
+def region_centroids():
+    """Return [(id, latitude, longitude), ...] for every region, cached until a region changes in any process"""
+    version = DataVersion.objects.filter(name=REGIONS_VERSION).values_list('version', flat=True).first() or 0
+    return cache.get_or_set(
+        REGION_CENTROIDS_CACHE_KEY.format(version),
+        lambda: list(GeographicRegion.objects.values_list('id', 'latitude', 'longitude')),
+    )
+
+
+def forget_region_centroids():
+    """Make every process reload the region centers, e.g. after regions were bulk created"""
+    bump_data_versions([REGIONS_VERSION])
+
+
+def nearest_region_id(latitude, longitude):
+    """Return the id of the region whose center is closest to the given point"""
+    centroids = region_centroids()
+    if not centroids:
+        return None
+    longitude_scale = math.cos(math.radians(latitude))
+    return min(
+        centroids,
+        key=lambda centroid: (centroid[1] - latitude) ** 2 + ((centroid[2] - longitude) * longitude_scale) ** 2,
+    )[0]
+
+
+def resolve_purchase_region(user, latitude=None, longitude=None):
+    """Pick the region a checkout is attributed to.
+
+    Uses the nearest region to the given coordinates when the client sends them,
+    otherwise the user's cached default region, which starts out as the region of
+    their latest purchase or the one closest to the store.
+    """
+    cache_key = USER_REGION_CACHE_KEY.format(user.id)
+    if latitude is not None and longitude is not None:
+        region_id = nearest_region_id(latitude, longitude)
+    else:
+        region_id = cache.get(cache_key)
+        if region_id not in {centroid[0] for centroid in region_centroids()}:
+            region_id = user.movie_purchases.order_by('-purchase_date').values_list('region_id', flat=True).first()
+            if region_id is None:
+                region_id = nearest_region_id(*STORE_LOCATION)
+    if region_id is not None:
+        cache.set(cache_key, region_id, USER_REGION_CACHE_TIMEOUT)
+    return region_id
+
+
+def encode_date_cursor(obj):
+    """Encode the (date, id) position of a review or order as an opaque cursor"""
+    return base64.urlsafe_b64encode(f'{obj.date.isoformat()}|{obj.id}'.encode()).decode()
+
+
+def decode_date_cursor(cursor):
+    """Decode a cursor made by encode_date_cursor, raising ValueError if it is malformed"""
+    try:
+        date, obj_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        date, obj_id = datetime.fromisoformat(date), int(obj_id)
+    except (TypeError, UnicodeDecodeError, binascii.Error) as error:
+        raise ValueError(f'Invalid cursor: {cursor!r}') from error
+    # Cursors we issue always hold an aware date and a database id
+    if date.tzinfo is None or not 0 < obj_id < 2 ** 63:
+        raise ValueError(f'Invalid cursor: {cursor!r}')
+    return date, obj_id
+
+
+def date_keyset_page(queryset, cursor, page_size):
+    """Return (objects, next_cursor) for a queryset walked newest first by (date, id)"""
+    queryset = queryset.order_by('-date', '-id')
+    if cursor:
+        date, obj_id = decode_date_cursor(cursor)
+        queryset = queryset.filter(Q(date__lt=date) | Q(date=date, id__lt=obj_id))
+    objects = list(queryset[:page_size + 1])
+    if len(objects) > page_size:
+        return objects[:page_size], encode_date_cursor(objects[page_size - 1])
+    return objects, None
+
+
+def review_page(movie, cursor=None, page_size=REVIEWS_PAGE_SIZE):
+    """Return (reviews, next_cursor) for a movie, newest first, seeking past the cursor"""
+    return date_keyset_page(Review.objects.filter(movie=movie).select_related('user'), cursor, page_size)
@@ -1,41 +1,102 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from .models import Movie, Review, MoviePetition, PetitionVote, MovieRating, GeographicRegion, MoviePurchase
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Count, Q, Sum, Avg
-from django.http import JsonResponse
+from django.db import transaction
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.urls import reverse
+from asgiref.sync import sync_to_async
+from django.utils import formats, timezone
+from .exports import EXPORT_FORMATS, aexport_lines, export_lines, export_rows
+from .page_cache import cache_anonymous_page, tags_etag
+from .search import SEARCH_PAGE_SIZE, search_movies
+from .trending import TRENDING, trending_by_region
+from .utils import atop_movies_by_region, review_page, with_region_purchases
 
-def index(request):
+MAX_BATCH_REGIONS = 100
+MAX_TOP_MOVIES = 20
+# ?window= choices of the map pages: all-time totals, purchases in a recent window, or decayed trending score
+POPULARITY_WINDOWS = {'all': 'All time', '24h': 'Last 24 hours', '7d': 'Last 7 days', '30d': 'Last 30 days', TRENDING: 'Trending now'}
+
+# The read-only catalog and map views are async; templates still render in a worker
+# thread because the context processors read the session and user lazily
+arender = sync_to_async(render)
+
+@cache_anonymous_page('movie_list')
+async def index(request):
     search_term = request.GET.get('search')
+    template_data = {}
+    template_data['title'] = 'Movies - Georgia Tech Movie Store'
     if search_term:
-        movies = Movie.objects.filter(name__icontains=search_term, amount_left__gt=0)
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        # Sold out movies are filtered inside the ranking; one extra result tells whether there is a next page
+        results = await sync_to_async(search_movies)(
+            search_term, limit=SEARCH_PAGE_SIZE + 1, offset=(page - 1) * SEARCH_PAGE_SIZE, in_stock=True
+        )
+        found = await Movie.objects.ain_bulk([movie_id for movie_id, snippet in results[:SEARCH_PAGE_SIZE]])
+        movies = []
+        for movie_id, snippet in results[:SEARCH_PAGE_SIZE]:
+            if movie_id in found:
+                movie = found[movie_id]
+                movie.search_snippet = snippet
+                movies.append(movie)
+        template_data['page'] = page
+        template_data['has_next_page'] = len(results) > SEARCH_PAGE_SIZE
     else:
-        movies = Movie.objects.filter(amount_left__gt=0)
+        movies = [movie async for movie in Movie.objects.filter(amount_left__gt=0)]
 
-    template_data = {}
-    template_data['title'] = 'Movies - Georgia Tech Movie Store'
     template_data['movies'] = movies
-    return render(request, 'movies/index.html', {'template_data': template_data})
+    return await arender(request, 'movies/index.html', {'template_data': template_data})
 
+@cache_anonymous_page('movie:{id}')
 def show(request, id):
-    movie = Movie.objects.get(id=id)
-    reviews = Review.objects.filter(movie=movie)
+    movie = get_object_or_404(Movie, id=id)
+    reviews, next_cursor = review_page(movie)
     
     # Get user's rating if they're logged in
     user_rating = None
     if request.user.is_authenticated:
-        try:
-            user_rating = MovieRating.objects.get(movie=movie, user=request.user)
-        except MovieRating.DoesNotExist:
-            user_rating = None
+        user_rating = MovieRating.objects.filter(movie=movie, user=request.user).first()
 
     template_data = {}
     template_data['title'] = f'{movie.name} - Georgia Tech Movie Store'
     template_data['movie'] = movie
     template_data['reviews'] = reviews
+    template_data['next_cursor'] = next_cursor
     template_data['user_rating'] = user_rating
     return render(request, 'movies/show.html', {'template_data': template_data})
 
+def review_page_api(request, id):
+    """API endpoint returning the next page of a movie's reviews for infinite scroll"""
+    movie = get_object_or_404(Movie, id=id)
+    try:
+        reviews, next_cursor = review_page(movie, request.GET.get('cursor'))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    
+    data = {
+        'reviews': [
+            {
+                'id': review.id,
+                'username': review.user.username,
+                'comment': review.comment,
+                'date': formats.date_format(timezone.localtime(review.date), 'DATETIME_FORMAT'),
+                'edit_url': reverse('movies.edit_review', kwargs={'id': movie.id, 'review_id': review.id}) if request.user == review.user else None,
+                'delete_url': reverse('movies.delete_review', kwargs={'id': movie.id, 'review_id': review.id}) if request.user == review.user else None,
+            }
+            for review in reviews
+        ],
+        'next_cursor': next_cursor,
+    }
+    
+    return JsonResponse(data)
+
 @login_required
 def create_review(request, id):
     if request.method == 'POST' and request.POST['comment'] != '':
@@ -75,12 +136,10 @@ def delete_review(request, id, review_id):
     return redirect('movies.show', id=id)
 
 # Petition views
+@cache_anonymous_page('petitions')
 def petition_list(request):
     """Display all movie petitions ordered by vote count"""
-    petitions = MoviePetition.objects.annotate(
-        yes_votes=Count('votes', filter=Q(votes__vote_type='yes')),
-        no_votes=Count('votes', filter=Q(votes__vote_type='no'))
-    ).order_by('-yes_votes', '-created_at')
+    petitions = MoviePetition.objects.select_related('created_by').order_by('-yes_votes', '-created_at')
     
     template_data = {}
     template_data['title'] = 'Movie Petitions - Georgia Tech Movie Store'
@@ -149,22 +208,24 @@ def vote_petition(request, petition_id):
         vote_type = request.POST.get('vote_type')
         
         if vote_type in ['yes', 'no']:
-            # Check if user already voted
-            existing_vote = PetitionVote.objects.filter(petition=petition, user=request.user).first()
-            
-            if existing_vote:
-                # Update existing vote
-                existing_vote.vote_type = vote_type
-                existing_vote.save()
-                messages.info(request, f'Your vote has been updated to {vote_type}.')
-            else:
-                # Create new vote
-                vote = PetitionVote()
-                vote.petition = petition
-                vote.user = request.user
-                vote.vote_type = vote_type
-                vote.save()
-                messages.success(request, f'Thank you for voting {vote_type}!')
+            with transaction.atomic():
+                # Check if user already voted
+                existing_vote = PetitionVote.objects.select_for_update().filter(petition=petition, user=request.user).first()
+                
+                if existing_vote:
+                    # Update existing vote; the PetitionVote signals move the petition's tallies
+                    if existing_vote.vote_type != vote_type:
+                        existing_vote.vote_type = vote_type
+                        existing_vote.save()
+                    messages.info(request, f'Your vote has been updated to {vote_type}.')
+                else:
+                    # Create new vote
+                    vote = PetitionVote()
+                    vote.petition = petition
+                    vote.user = request.user
+                    vote.vote_type = vote_type
+                    vote.save()
+                    messages.success(request, f'Thank you for voting {vote_type}!')
             
             return redirect('movies.petition_detail', petition_id=petition_id)
     
@@ -182,40 +243,44 @@ def rate_movie(request, movie_id):
         if rating_value and rating_value.isdigit():
             rating_value = int(rating_value)
             if 1 <= rating_value <= 5:
-                # Check if user already rated this movie
-                existing_rating = MovieRating.objects.filter(movie=movie, user=request.user).first()
-                
-                if existing_rating:
-                    # Update existing rating
-                    existing_rating.rating = rating_value
-                    existing_rating.save()
-                    messages.info(request, f'Your rating for "{movie.name}" has been updated to {rating_value} stars.')
-                else:
-                    # Create new rating
-                    rating = MovieRating()
-                    rating.movie = movie
-                    rating.user = request.user
-                    rating.rating = rating_value
-                    rating.save()
-                    messages.success(request, f'Thank you for rating "{movie.name}" {rating_value} stars!')
+                with transaction.atomic():
+                    # Check if user already rated this movie
+                    existing_rating = MovieRating.objects.select_for_update().filter(movie=movie, user=request.user).first()
+                    
+                    if existing_rating:
+                        # Update existing rating
+                        existing_rating.rating = rating_value
+                        existing_rating.save()
+                        messages.info(request, f'Your rating for "{movie.name}" has been updated to {rating_value} stars.')
+                    else:
+                        # Create new rating
+                        rating = MovieRating()
+                        rating.movie = movie
+                        rating.user = request.user
+                        rating.rating = rating_value
+                        rating.save()
+                        messages.success(request, f'Thank you for rating "{movie.name}" {rating_value} stars!')
                 
                 return redirect('movies.show', id=movie_id)
     
     return redirect('movies.show', id=movie_id)
 
 # Local Popularity Map views
-def local_popularity_map(request):
+@cache_anonymous_page('popularity')
+async def local_popularity_map(request):
     """Display the local popularity map"""
-    regions = GeographicRegion.objects.all()
+    regions = [region async for region in GeographicRegion.objects.all()]
+    window = popularity_window(request)
+    
+    # Get the top 5 movies of every region in one grouped query
+    if window == 'all':
+        top_movies_by_region_id = await atop_movies_by_region(limit=5)
+    else:
+        top_movies_by_region_id = await sync_to_async(trending_by_region)(window, limit=5)
     
-    # Get trending movies by region
     region_data = []
     for region in regions:
-        # Get top 5 movies by purchase count in this region
-        top_movies = Movie.objects.annotate(
-            region_purchases=Sum('purchases__quantity', filter=Q(purchases__region=region))
-        ).filter(region_purchases__gt=0).order_by('-region_purchases')[:5]
-        
+        top_movies = top_movies_by_region_id.get(region.id, [])
         region_data.append({
             'region': region,
             'top_movies': top_movies,
@@ -225,36 +290,91 @@ def local_popularity_map(request):
     template_data = {}
     template_data['title'] = 'Local Popularity Map - Georgia Tech Movie Store'
     template_data['regions'] = region_data
+    template_data['window'] = window
+    template_data['windows'] = POPULARITY_WINDOWS
     
-    return render(request, 'movies/local_popularity_map.html', {'template_data': template_data})
+    return await arender(request, 'movies/local_popularity_map.html', {'template_data': template_data})
 
 def region_detail(request, region_id):
     """Display detailed trending movies for a specific region"""
     region = get_object_or_404(GeographicRegion, id=region_id)
+    window = popularity_window(request)
     
-    # Get all movies with their purchase counts in this region
-    movies = Movie.objects.annotate(
-        region_purchases=Sum('purchases__quantity', filter=Q(purchases__region=region)),
-        avg_rating=Avg('ratings__rating')
-    ).filter(region_purchases__gt=0).order_by('-region_purchases')
+    # Get all movies with their purchase counts in this region from the rollup, or from the trend buckets
+    if window == 'all':
+        movies = [
+            with_region_purchases(entry)
+            for entry in region.movie_popularity.filter(total_quantity__gt=0).select_related('movie').order_by('-total_quantity', 'movie_id')
+        ]
+    else:
+        movies = trending_by_region(window, limit=None, region_ids=[region.id]).get(region.id, [])
     
     template_data = {}
     template_data['title'] = f'Trending Movies in {region.name} - Georgia Tech Movie Store'
     template_data['region'] = region
     template_data['movies'] = movies
+    template_data['window'] = window
+    template_data['windows'] = POPULARITY_WINDOWS
     
     return render(request, 'movies/region_detail.html', {'template_data': template_data})
 
-def region_data_api(request, region_id):
+async def region_data_api(request, region_id):
     """API endpoint to get region data for map markers"""
-    region = get_object_or_404(GeographicRegion, id=region_id)
+    region = await aget_object_or_404(GeographicRegion, id=region_id)
     
     # Get top movies in this region
-    top_movies = Movie.objects.annotate(
-        region_purchases=Sum('purchases__quantity', filter=Q(purchases__region=region))
-    ).filter(region_purchases__gt=0).order_by('-region_purchases')[:5]
-    
-    data = {
+    top_movies = (await atop_movies_by_region(limit=5, region_ids=[region.id])).get(region.id, [])
+    return JsonResponse(region_marker(region, top_movies))
+
+async def regions_data_api(request):
+    """API endpoint returning the map markers of every region in one call.
+
+    Optional filters: ids=1,2,3, bbox=south,west,north,east (degrees) and limit
+    (top movies per region). Three queries, or one when the client's
+    If-None-Match still matches the ETag.
+    """
+    # The ETag only changes when purchases, regions, movies or ratings do
+    etag = await sync_to_async(tags_etag)(request, 'popularity', 'ratings')
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        not_modified['ETag'] = etag
+        not_modified['Cache-Control'] = 'no-cache'
+        return not_modified
+
+    regions = GeographicRegion.objects.order_by('id')
+    try:
+        limit = int(request.GET.get('limit', 5))
+        ids = request.GET.get('ids')
+        if ids:
+            region_ids = [int(region_id) for region_id in ids.split(',')]
+            if len(region_ids) > MAX_BATCH_REGIONS:
+                raise ValueError(f'At most {MAX_BATCH_REGIONS} ids per request')
+            regions = regions.filter(id__in=region_ids)
+        bbox = request.GET.get('bbox')
+        if bbox:
+            south, west, north, east = (float(value) for value in bbox.split(','))
+            regions = regions.filter(latitude__range=(south, north), longitude__range=(west, east))
+    except ValueError:
+        return JsonResponse({'error': 'ids must be region ids, bbox four numbers and limit a number'}, status=400)
+    if not 1 <= limit <= MAX_TOP_MOVIES:
+        return JsonResponse({'error': f'limit must be between 1 and {MAX_TOP_MOVIES}'}, status=400)
+
+    regions = [region async for region in regions]
+    filtered = bool(request.GET.get('ids') or request.GET.get('bbox'))
+    top_movies = await atop_movies_by_region(limit=limit, region_ids=[region.id for region in regions] if filtered else None)
+    response = JsonResponse({'regions': [region_marker(region, top_movies.get(region.id, [])) for region in regions]})
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+def popularity_window(request):
+    """The ?window= of a map page, falling back to all-time totals for unknown values"""
+    window = request.GET.get('window', 'all')
+    return window if window in POPULARITY_WINDOWS else 'all'
+
+def region_marker(region, top_movies):
+    """The JSON data of one region's map marker; ratings come from the movies' stored aggregates"""
+    return {
         'region': {
             'id': region.id,
             'name': region.name,
@@ -262,6 +382,7 @@ def region_data_api(request, region_id):
             'longitude': region.longitude,
             'zoom_level': region.zoom_level
         },
+        'total_purchases': sum(movie.region_purchases for movie in top_movies),
         'top_movies': [
             {
                 'id': movie.id,
@@ -273,5 +394,23 @@ def region_data_api(request, region_id):
             for movie in top_movies
         ]
     }
+
+@staff_member_required
+def export_data(request, table):
+    """Stream a history table as CSV or JSON Lines with optional start/end/region filters"""
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest('format must be csv or jsonl')
+    try:
+        columns, rows = export_rows(table, request.GET.get('start'), request.GET.get('end'), request.GET.get('region'))
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
     
-    return JsonResponse(data)
\ No newline at end of file
+    content_type = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    lines = export_lines(columns, rows, export_format)
+    if isinstance(request, ASGIRequest):
+        # ASGI servers only stream async iterators; WSGI servers only stream sync ones
+        lines = aexport_lines(lines)
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{table}.{export_format}"'
+    return response
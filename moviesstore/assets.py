@@ -0,0 +1,193 @@
+"""
+Static and media file serving for the Georgia Tech Movie Store.
+
+CompressedManifestStaticFilesStorage gives collected static files content
+hashed names and writes .gz (and, when the optional brotli package is
+installed, .br) copies next to them at collectstatic time.
+
+AssetMiddleware answers STATIC_URL and MEDIA_URL requests before any other
+middleware runs. Hashed static files are served forever-cacheable with the
+best precompressed copy the client accepts; media files support conditional
+and single range requests, or are handed to the front-end server through
+settings.MEDIA_SENDFILE (X-Sendfile or X-Accel-Redirect).
+"""
+
+import gzip
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip copies are always written
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.ico', '.ttf', '.otf', '.eot'}
+# Only keep a compressed copy that saves at least this share of the file
+MIN_COMPRESSION_SAVING = 0.05
+# ManifestStaticFilesStorage inserts a 12 character MD5 prefix before the extension
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^/.]+$')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+STATIC_CACHE_CONTROL = 'public, max-age=3600'
+MEDIA_CACHE_CONTROL = 'public, max-age=86400'
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def url_converter(self, name, hashed_files, template=None):
+        converter = super().url_converter(name, hashed_files, template)
+
+        def convert(matchobj):
+            # Leave references to files that were never collected (such as the
+            # background image in style.css) as they are instead of failing collectstatic
+            try:
+                return converter(matchobj)
+            except ValueError:
+                return matchobj['matched']
+
+        return convert
+
+    def post_process(self, paths, dry_run=False, **options):
+        processed_names = set()
+        for original_path, processed_path, processed in super().post_process(paths, dry_run, **options):
+            if processed_path and not isinstance(processed, Exception):
+                processed_names.add(processed_path)
+            yield original_path, processed_path, processed
+        if dry_run:
+            return
+        for name in sorted(processed_names):
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                self.compress(name)
+
+    def compress(self, name):
+        path = self.path(name)
+        with open(path, 'rb') as source:
+            data = source.read()
+        compressors = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            compressors.append(('.br', lambda data: brotli.compress(data, quality=11)))
+        for suffix, compress in compressors:
+            compressed = compress(data)
+            if len(compressed) <= len(data) * (1 - MIN_COMPRESSION_SAVING):
+                with open(path + suffix, 'wb') as target:
+                    target.write(compressed)
+
+
+def serve_asset(request):
+    """A response for a static or media file, or None when the request is not for one"""
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    if request.path.startswith(settings.STATIC_URL) and settings.STATIC_ROOT:
+        name = request.path[len(settings.STATIC_URL):]
+        cache_control = IMMUTABLE_CACHE_CONTROL if HASHED_NAME.search(name) else STATIC_CACHE_CONTROL
+        return serve_file(request, settings.STATIC_ROOT, name, cache_control, precompressed=True)
+    if request.path.startswith(settings.MEDIA_URL) and settings.MEDIA_ROOT:
+        name = request.path[len(settings.MEDIA_URL):]
+        return serve_file(request, settings.MEDIA_ROOT, name, MEDIA_CACHE_CONTROL, ranges=True)
+    return None
+
+
+def serve_file(request, root, name, cache_control, precompressed=False, ranges=False):
+    try:
+        path = safe_join(root, name)
+    except SuspiciousFileOperation:
+        return None
+    if not os.path.isfile(path):
+        return None
+
+    content_type, _ = mimetypes.guess_type(path)
+    encoding = None
+    if precompressed and os.path.splitext(path)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+        accepted = request.headers.get('Accept-Encoding', '')
+        for candidate, suffix in ENCODINGS:
+            if candidate in accepted and os.path.isfile(path + suffix):
+                encoding, path = candidate, path + suffix
+                break
+
+    stat = os.stat(path)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}{"-" + encoding if encoding else ""}"'
+    headers = {
+        'Content-Type': content_type or 'application/octet-stream',
+        'Cache-Control': cache_control,
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+    }
+    if precompressed:
+        headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    if ranges:
+        headers['Accept-Ranges'] = 'bytes'
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is not None:
+        for header in ('Cache-Control', 'ETag', 'Last-Modified', 'Vary'):
+            if header in headers:
+                response[header] = headers[header]
+        return response
+
+    if ranges and settings.MEDIA_SENDFILE:
+        return sendfile_response(name, path, headers)
+    if ranges and 'Range' in request.headers:
+        response = range_response(request, path, stat.st_size, etag, headers)
+        if response is not None:
+            return response
+
+    return FileResponse(open(path, 'rb'), filename=os.path.basename(name), headers=headers)
+
+
+def sendfile_response(name, path, headers):
+    """Let the front-end server stream the file, including any range request"""
+    response = HttpResponse(headers=headers)
+    if settings.MEDIA_SENDFILE == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = settings.MEDIA_SENDFILE_PREFIX + name
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+
+def range_response(request, path, size, etag, headers):
+    """A 206 or 416 response for a single byte range, or None to send the whole file"""
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range != etag:
+        return None
+    match = RANGE.match(request.headers['Range'].strip())
+    if not match or match.groups() == ('', ''):
+        return None
+
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        # "bytes=-500" asks for the last 500 bytes
+        start, end = max(size - int(last), 0), size - 1
+    if start >= size or start > end:
+        response = HttpResponse(status=416, headers=headers)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    response = StreamingHttpResponse(read_range(path, start, end - start + 1), status=206, headers=headers)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = end - start + 1
+    return response
+
+
+def read_range(path, start, length):
+    with open(path, 'rb') as source:
+        source.seek(start)
+        while length > 0:
+            chunk = source.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
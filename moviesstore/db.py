@@ -0,0 +1,19 @@
+"""
+Database connection tuning for the Georgia Tech Movie Store.
+
+apply_sqlite_pragmas is connected to connection_created and runs the PRAGMAs
+listed in settings.SQLITE_PRAGMAS on every new SQLite connection.
+"""
+
+from django.conf import settings
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,186 @@
+"""
+Per-route request metrics for the Georgia Tech Movie Store.
+
+RequestMetricsMiddleware times every request and, for a sampled share of them
+(settings.METRICS_SAMPLE_RATE), also counts SQL queries, SQL time, duplicated
+queries and template render time. Each route keeps its last METRICS_WINDOW
+observations so the percentiles follow recent traffic. The metrics live in the
+memory of each worker process and are served in the Prometheus text format by
+the staff-only `metrics` view.
+
+Template render time comes from the TimedDjangoTemplates backend configured in
+settings.TEMPLATES; it only measures while a sampled request is running.
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse
+from django.template.backends.django import DjangoTemplates, Template
+
+QUANTILES = (0.5, 0.9, 0.99)
+MAX_FINGERPRINTS = 20
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# name: (help, whether the value is only known for sampled requests)
+SUMMARIES = {
+    'request_duration_seconds': ('Time spent in Django per request', False),
+    'response_size_bytes': ('Size of non-streaming response bodies', False),
+    'sql_queries': ('SQL queries per request', True),
+    'sql_duration_seconds': ('Time spent in SQL per request', True),
+    'template_duration_seconds': ('Time spent rendering templates per request', True),
+}
+
+current_sample = ContextVar('current_sample', default=None)
+
+# Collapse the variable length "IN (%s, %s, ...)" lists so they share one fingerprint
+IN_LIST = re.compile(r'\((?:%s, )*%s\)')
+
+
+class Sample:
+    """What one sampled request spent in the database and the template engine"""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        # A database execute_wrapper: time every query and remember its shape
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_seconds += time.perf_counter() - start
+            self.queries += 1
+            self.statements[IN_LIST.sub('(...)', sql)] += 1
+
+    def duplicates(self):
+        return {sql: count for sql, count in self.statements.items() if count > 1}
+
+
+class RouteMetrics:
+    def __init__(self, window):
+        self.requests = 0
+        self.windows = {name: deque(maxlen=window) for name in SUMMARIES}
+        self.totals = dict.fromkeys(SUMMARIES, 0.0)
+        self.counts = dict.fromkeys(SUMMARIES, 0)
+        self.duplicates = Counter()
+
+    def observe(self, name, value):
+        self.windows[name].append(value)
+        self.totals[name] += value
+        self.counts[name] += 1
+
+
+class Registry:
+    """Metrics of every route, shared by the threads of one worker process"""
+
+    def __init__(self):
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def record(self, route, duration, size, sample):
+        with self.lock:
+            self._record(route, duration, size, sample)
+
+    def _record(self, route, duration, size, sample):
+        metrics = self.routes.get(route)
+        if metrics is None:
+            metrics = self.routes[route] = RouteMetrics(settings.METRICS_WINDOW)
+        metrics.requests += 1
+        metrics.observe('request_duration_seconds', duration)
+        if size is not None:
+            metrics.observe('response_size_bytes', size)
+        if sample is not None:
+            metrics.observe('sql_queries', sample.queries)
+            metrics.observe('sql_duration_seconds', sample.sql_seconds)
+            metrics.observe('template_duration_seconds', sample.template_seconds)
+            for sql, count in sample.duplicates().items():
+                if sql in metrics.duplicates or len(metrics.duplicates) < MAX_FINGERPRINTS:
+                    metrics.duplicates[sql] += count - 1
+
+    def clear(self):
+        with self.lock:
+            self.routes.clear()
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format"""
+        with self.lock:
+            return self._render()
+
+    def _render(self):
+        routes = sorted(self.routes.items())
+        lines = [
+            '# HELP moviesstore_requests_total Requests handled per route',
+            '# TYPE moviesstore_requests_total counter',
+        ]
+        lines += [f'moviesstore_requests_total{{route="{escape(route)}"}} {metrics.requests}' for route, metrics in routes]
+
+        for name, (help_text, sampled) in SUMMARIES.items():
+            metric = f'moviesstore_{name}'
+            lines += [f'# HELP {metric} {help_text}' + (' (sampled requests only)' if sampled else ''), f'# TYPE {metric} summary']
+            for route, metrics in routes:
+                window = sorted(metrics.windows[name])
+                if not window:
+                    continue
+                label = f'route="{escape(route)}"'
+                for quantile in QUANTILES:
+                    value = window[min(len(window) - 1, int(quantile * len(window)))]
+                    lines.append(f'{metric}{{{label},quantile="{quantile}"}} {value}')
+                lines.append(f'{metric}_sum{{{label}}} {metrics.totals[name]}')
+                lines.append(f'{metric}_count{{{label}}} {metrics.counts[name]}')
+
+        lines += [
+            '# HELP moviesstore_duplicate_queries_total Repeated executions of the same SQL within one sampled request',
+            '# TYPE moviesstore_duplicate_queries_total counter',
+        ]
+        for route, metrics in routes:
+            for sql, count in metrics.duplicates.most_common():
+                fingerprint = hashlib.md5(sql.encode()).hexdigest()[:12]
+                lines.append(
+                    f'moviesstore_duplicate_queries_total{{route="{escape(route)}",fingerprint="{fingerprint}",'
+                    f'query="{escape(sql[:200])}"}} {count}'
+                )
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        sample = current_sample.get()
+        if sample is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            sample.template_seconds += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, adding each render's time to the sampled request, if any"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+@staff_member_required
+def metrics(request):
+    return HttpResponse(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
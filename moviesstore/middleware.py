@@ -0,0 +1,176 @@
+"""
+Middleware for the Georgia Tech Movie Store.
+
+Every middleware here supports both WSGI and ASGI, so async views keep running
+on the event loop instead of being pushed onto a thread by a sync middleware.
+"""
+
+import random
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .assets import serve_asset
+from .metrics import Sample, current_sample, registry
+from .routers import primary_pinned
+
+PIN_COOKIE = 'primary_pin'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+
+class HybridMiddleware:
+    """Base class for middleware that runs natively under both WSGI and ASGI.
+
+    Subclasses override handle() for WSGI and __acall__() for ASGI; on its own it
+    passes requests straight through.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.handle(request)
+
+    def handle(self, request):
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+
+class ReplicaPinningMiddleware(HybridMiddleware):
+    """Send every read to the primary during writes and for a short window after them.
+
+    A write request sets a short-lived cookie, so the user sees their own rating,
+    vote or review right away even if the replicas have not caught up yet.
+    """
+
+    def handle(self, request):
+        token = primary_pinned.set(self.pins(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            primary_pinned.reset(token)
+        return self.set_pin(request, response)
+
+    async def __acall__(self, request):
+        # Context variables are copied into the threads that run the async ORM queries
+        token = primary_pinned.set(self.pins(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            primary_pinned.reset(token)
+        return self.set_pin(request, response)
+
+    def pins(self, request):
+        return request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES
+
+    def set_pin(self, request, response):
+        if request.method not in SAFE_METHODS and settings.READ_REPLICAS:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
+
+
+class RequestMetricsMiddleware(HybridMiddleware):
+    """Record per-route timings in moviesstore.metrics and report them in a Server-Timing header.
+
+    Only a METRICS_SAMPLE_RATE share of requests wraps the database connections
+    and templates; the rest only pay for two clock reads. The header is only sent
+    with DEBUG on or to staff, since it reveals query counts and timings.
+    """
+
+    def handle(self, request):
+        sample = self.start_sample()
+        start = time.perf_counter()
+        if sample is None:
+            response = self.get_response(request)
+        else:
+            token = current_sample.set(sample)
+            try:
+                with ExitStack() as stack:
+                    self.wrap_connections(stack, sample)
+                    response = self.get_response(request)
+            finally:
+                current_sample.reset(token)
+        duration = time.perf_counter() - start
+        user = getattr(request, 'user', None)
+        return self.record(request, response, duration, sample, settings.DEBUG or getattr(user, 'is_staff', False))
+
+    async def __acall__(self, request):
+        sample = self.start_sample()
+        start = time.perf_counter()
+        if sample is None:
+            response = await self.get_response(request)
+        else:
+            token = current_sample.set(sample)
+            stack = ExitStack()
+            try:
+                # Connections belong to the thread that runs this request's ORM calls, so wrap them there
+                await sync_to_async(self.wrap_connections)(stack, sample)
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stack.close)()
+                current_sample.reset(token)
+        duration = time.perf_counter() - start
+        show_timing = settings.DEBUG
+        if not show_timing and hasattr(request, 'auser'):
+            # request.user would load the session synchronously on the event loop
+            show_timing = (await request.auser()).is_staff
+        return self.record(request, response, duration, sample, show_timing)
+
+    def start_sample(self):
+        return Sample() if random.random() < settings.METRICS_SAMPLE_RATE else None
+
+    def wrap_connections(self, stack, sample):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(sample))
+
+    def record(self, request, response, duration, sample, show_timing):
+        match = request.resolver_match
+        route = match.view_name if match else '<unresolved>'
+        size = None if response.streaming else len(response.content)
+        registry.record(route, duration, size, sample)
+        if not show_timing:
+            return response
+
+        timings = [f'app;dur={duration * 1000:.1f}']
+        if sample is not None:
+            timings += [
+                f'db;dur={sample.sql_seconds * 1000:.1f};desc="{sample.queries} queries"',
+                f'tpl;dur={sample.template_seconds * 1000:.1f}',
+            ]
+        response['Server-Timing'] = ', '.join(timings)
+        return response
+
+
+class AssetMiddleware(HybridMiddleware):
+    """Serve static and media files before sessions, authentication and the URL resolver run.
+
+    Requests for anything else, or for files that do not exist, fall through to the rest of the stack.
+    """
+
+    def handle(self, request):
+        response = serve_asset(request)
+        if response is None:
+            response = self.get_response(request)
+        return response
+
+    async def __acall__(self, request):
+        response = None
+        if request.path.startswith((settings.STATIC_URL, settings.MEDIA_URL)):
+            # Looking files up touches the disk, so keep it off the event loop
+            response = await sync_to_async(serve_asset)(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
@@ -0,0 +1,50 @@
+"""
+Database routing for the Georgia Tech Movie Store.
+
+Catalog, popularity and petition reads go to a random read replica listed in
+settings.READ_REPLICAS. Everything else, every write, reads inside a transaction
+and all reads of a request pinned by ReplicaPinningMiddleware use the primary.
+"""
+
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Models whose reads can tolerate replication lag
+REPLICA_MODELS = {
+    'movies.movie',
+    'movies.review',
+    'movies.moviepetition',
+    'movies.petitionvote',
+    'movies.geographicregion',
+    'movies.moviepurchase',
+    'movies.regionmoviepopularity',
+}
+
+primary_pinned = ContextVar('primary_pinned', default=False)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = settings.READ_REPLICAS
+        if (
+            not replicas
+            or primary_pinned.get()
+            or model._meta.label_lower not in REPLICA_MODELS
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.READ_REPLICAS}
+        return obj1._state.db in databases and obj2._state.db in databases
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary and are never migrated directly
+        return db == DEFAULT_DB_ALIAS
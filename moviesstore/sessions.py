@@ -0,0 +1,35 @@
+"""
+Write-coalescing session backend for the Georgia Tech Movie Store.
+
+Behaves like Django's cached_db backend but skips the database and cache write
+when a request marks the session modified without actually changing its data,
+e.g. by assigning a value that is already stored. Like cached_db it is only safe
+on a cache every worker shares (SESSION_CACHE_ALIAS), which settings enforce.
+"""
+
+import copy
+
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+
+
+class SessionStore(CachedDBStore):
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._persisted_data = None
+
+    def load(self):
+        data = super().load()
+        self._persisted_data = copy.deepcopy(data)
+        return data
+
+    def save(self, must_create=False):
+        unchanged = (
+            not must_create
+            and self.session_key is not None
+            and self._persisted_data is not None
+            and getattr(self, '_session_cache', None) == self._persisted_data
+        )
+        if unchanged:
+            return
+        super().save(must_create)
+        self._persisted_data = copy.deepcopy(self._session)
@@ -13,6 +13,9 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 import os
 from pathlib import Path
 
+import django
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -45,7 +48,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'moviesstore.middleware.AssetMiddleware',
+    'moviesstore.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'moviesstore.middleware.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -58,7 +64,8 @@ ROOT_URLCONF = 'moviesstore.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that also reports render times to moviesstore.metrics
+        'BACKEND': 'moviesstore.metrics.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'moviesstore/templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -81,9 +88,119 @@ WSGI_APPLICATION = 'moviesstore.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('MOVIESSTORE_DB_NAME', BASE_DIR / 'db.sqlite3'),
+    }
+}
+
+# MOVIESSTORE_DB_PROFILE=production switches SQLite to WAL mode with tuned pragmas
+# (applied by moviesstore.db.apply_sqlite_pragmas) and persistent connections.
+# Compare the profiles with `python manage.py stress_sqlite`.
+DB_PROFILE = os.environ.get('MOVIESSTORE_DB_PROFILE', 'development')
+SQLITE_PRAGMAS = {}
+
+if DB_PROFILE == 'production':
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'busy_timeout': 5000,
+        'synchronous': 'NORMAL',
+        'mmap_size': 128 * 1024 * 1024,
+        'cache_size': -20000,  # negative values are KiB, so ~20 MB
+        'temp_store': 'MEMORY',
     }
+    DATABASES['default']['CONN_MAX_AGE'] = 600
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+    if django.VERSION >= (5, 1):
+        # Take the write lock at BEGIN so concurrent writers wait on busy_timeout
+        # instead of failing when they upgrade a read lock
+        DATABASES['default']['OPTIONS'] = {'transaction_mode': 'IMMEDIATE'}
+
+# MOVIESSTORE_READ_REPLICAS is a comma separated list of read replica SQLite files,
+# refreshed from the primary with `python manage.py sync_replicas`. Catalog,
+# popularity and petition reads are spread over them by moviesstore.routers; a
+# user's reads stay on the primary for REPLICA_PIN_SECONDS after they write.
+READ_REPLICAS = []
+for number, replica_name in enumerate(filter(None, os.environ.get('MOVIESSTORE_READ_REPLICAS', '').split(',')), 1):
+    alias = f'replica_{number}'
+    DATABASES[alias] = {**DATABASES['default'], 'NAME': replica_name.strip(), 'TEST': {'MIRROR': 'default'}}
+    READ_REPLICAS.append(alias)
+REPLICA_PIN_SECONDS = 10
+
+DATABASE_ROUTERS = ['moviesstore.routers.ReplicaRouter']
+
+# moviesstore.middleware.RequestMetricsMiddleware times every request; this share of
+# them also gets SQL and template instrumentation. The percentiles cover the last
+# METRICS_WINDOW requests per route and are served to staff at /metrics/.
+METRICS_SAMPLE_RATE = float(os.environ.get('MOVIESSTORE_METRICS_SAMPLE_RATE', '0.05'))
+METRICS_WINDOW = 1000
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'moviesstore',
+        'TIMEOUT': 60 * 15,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+    # Versions of the movies.page_cache tags. Every worker process must see the same
+    # store, so a write in one worker invalidates the pages cached by the others. The
+    # file backend covers the workers of one host; point it at Redis or the database
+    # cache when running on several hosts.
+    'page_tags': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('MOVIESSTORE_PAGE_TAG_CACHE', str(BASE_DIR / '.cache' / 'page_tags')),
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+        },
+    },
 }
+# Cached anonymous pages are dropped after this long even if no invalidation reached them
+PAGE_CACHE_SECONDS = 60
+
+
+# Sessions
+# https://docs.djangoproject.com/en/5.0/topics/http/sessions/#configuring-the-session-engine
+#
+# MOVIESSTORE_SESSION_MODE picks the storage: 'db' (one row read per request),
+# 'cached_db' (reads served from a cache), 'signed_cookies' (no server storage) or
+# 'coalesced' (cached_db that only writes when the session data really changed).
+# Compare them with `python manage.py benchmark_sessions`.
+#
+# The cached modes need a cache every worker shares, otherwise a session flushed at
+# logout in one worker stays valid in the others. Set MOVIESSTORE_SESSION_CACHE_URL
+# to a Redis URL to enable them.
+
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+    'coalesced': 'moviesstore.sessions',
+}
+SESSION_MODE = os.environ.get('MOVIESSTORE_SESSION_MODE', 'db')
+SESSION_ENGINE = SESSION_ENGINES[SESSION_MODE]
+SHARED_CACHE_BACKENDS = {
+    'django.core.cache.backends.redis.RedisCache',
+    'django.core.cache.backends.memcached.PyMemcacheCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+}
+SESSION_CACHE_ALIAS = 'default'
+
+if os.environ.get('MOVIESSTORE_SESSION_CACHE_URL'):
+    CACHES['sessions'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['MOVIESSTORE_SESSION_CACHE_URL'],
+    }
+    SESSION_CACHE_ALIAS = 'sessions'
+
+if SESSION_MODE in ('cached_db', 'coalesced') and CACHES[SESSION_CACHE_ALIAS]['BACKEND'] not in SHARED_CACHE_BACKENDS:
+    raise ImproperlyConfigured(
+        f"MOVIESSTORE_SESSION_MODE={SESSION_MODE} needs a shared session cache; set MOVIESSTORE_SESSION_CACHE_URL or use 'db'"
+    )
 
 
 # Password validation
@@ -123,6 +240,21 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'  # For production deployment
 
+# Outside DEBUG, collectstatic writes content-hashed copies of every file plus .gz
+# (and .br with the optional brotli package) versions, which
+# moviesstore.middleware.AssetMiddleware serves with immutable Cache-Control.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+            else 'moviesstore.assets.CompressedManifestStaticFilesStorage'
+        ),
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -133,4 +265,10 @@ STATICFILES_DIRS = [
 ]
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
-MEDIA_URL = '/media/'
\ No newline at end of file
+MEDIA_URL = '/media/'
+
+# MOVIESSTORE_MEDIA_SENDFILE=x-sendfile (Apache, lighttpd) or x-accel-redirect (nginx,
+# with an internal location at MEDIA_SENDFILE_PREFIX aliased to MEDIA_ROOT) hands media
+# downloads to the front-end server instead of streaming them through Python.
+MEDIA_SENDFILE = os.environ.get('MOVIESSTORE_MEDIA_SENDFILE') or None
+MEDIA_SENDFILE_PREFIX = '/protected-media/'
\ No newline at end of file
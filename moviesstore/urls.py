@@ -16,8 +16,7 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.conf.urls.static import static
-from django.conf import settings
+from .metrics import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -25,11 +24,6 @@ urlpatterns = [
     path('movies/', include('movies.urls')),
     path('accounts/', include('accounts.urls')),
     path('cart/', include('cart.urls')),
+    path('metrics/', metrics, name='metrics'),
 ]
-
-urlpatterns += static(settings.MEDIA_URL,
-    document_root=settings.MEDIA_ROOT)
-
-# Serve static files in production (not recommended for production, but useful for testing)
-if not settings.DEBUG:
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
+# Static and media files are served by moviesstore.middleware.AssetMiddleware
\ No newline at end of file